@@ -0,0 +1,157 @@
+''' Run many problems of solve.py in a pool of worker processes.
+
+The manifest has one job per line:
+
+    model-file constraints-file [slimit [ilimit]]
+    problem-name [slimit [ilimit]]
+
+where problem-name is one of solve.INPUT; empty lines and lines starting
+with // are skipped. Every job runs in its own process, killed after the
+timeout, and a summary table of the build/solve times and the numbers of
+solutions is printed (and written as CSV with -w).
+'''
+from molle import ABN, STEP
+from solve import INPUT, PREFIX
+from utility import conv_time
+from multiprocessing import Process, Queue
+from Queue import Empty
+from time import time, sleep, localtime, strftime
+import csv, sys
+
+def readManifest(f):
+    ''' Return the jobs of a manifest file object, as a list of
+    (mpath, epath, slimit, ilimit). '''
+    jobs = []
+    for line in f:
+        l = line.split()
+        if not l or l[0].startswith('//'): continue
+        if l[0] in INPUT:
+            mpath, epath = [ PREFIX + name for name in INPUT[l[0]] ]
+            l = l[1:]
+        else:
+            mpath, epath = l[:2]
+            l = l[2:]
+        slimit, ilimit = ([ int(i) for i in l ] + [10, 0][len(l):])[:2]
+        jobs.append((mpath, epath, slimit, ilimit))
+    return jobs
+
+def runJob(i, job, step, backend, results):
+    ''' Solve job i in the current process; report to the results Queue as
+    (i, event, value): 'build' with the build time, 'solution' with the
+    number of solutions so far, then 'done' with the solving time. '''
+    mpath, epath, slimit, ilimit = job
+    try:
+        start = time()
+        model = ABN(open(mpath), open(epath), step, backend)
+        model.build(ilimit=ilimit, detail=False)
+        results.put((i, 'build', time() - start))
+        start = time()
+        count = 0
+        for solution in model.solve():
+            count += 1
+            results.put((i, 'solution', count))
+            if count == slimit: break
+        results.put((i, 'done', time() - start))
+    except Exception as e:
+        results.put((i, 'error', '%s: %s'%(type(e).__name__, e)))
+
+def runBatch(jobs, nproc, timeout=0, step=STEP, backend='bv'):
+    ''' Run the jobs with at most nproc processes at once, each for at most
+    timeout seconds (no limit if 0). Return a list of dicts, one per job,
+    with the keys of SUMMARY. '''
+    results = Queue()
+    summary = [ dict(zip(('model', 'constraints', 'slimit', 'ilimit'), job),
+                     job=i+1, status='waiting', build=None, solve=None,
+                     solutions=0) for i, job in enumerate(jobs) ]
+    waiting = range(len(jobs))
+    running = {} # job index: (process, start time)
+    while waiting or running:
+        while waiting and len(running) < nproc:
+            i = waiting.pop(0)
+            p = Process(target=runJob,
+                        args=(i, jobs[i], step, backend, results))
+            p.daemon = True
+            p.start()
+            running[i] = (p, time())
+            summary[i]['status'] = 'running'
+        try:
+            i, event, value = results.get(timeout=0.5)
+            if event == 'build': summary[i]['build'] = value
+            elif event == 'solution': summary[i]['solutions'] = value
+            elif event == 'done':
+                summary[i]['solve'] = value
+                summary[i]['status'] = 'done'
+            else:
+                summary[i]['status'] = 'error'
+                print '>> Job %d failed: %s'%(i + 1, value)
+        except Empty:
+            pass
+        for i, (p, start) in running.items():
+            if summary[i]['status'] in ('done', 'error'):
+                p.join(); del running[i]
+                print '>> Job %d %s. (%d solutions)' \
+                    %(i + 1, summary[i]['status'], summary[i]['solutions'])
+            elif timeout and time() - start > timeout:
+                p.terminate(); p.join(); del running[i]
+                summary[i]['status'] = 'timeout'
+                print '>> Job %d timed out after %s.' \
+                    %(i + 1, conv_time(timeout))
+            elif not p.is_alive() and results.empty():
+                sleep(0.1) # its last events may be on the way
+                if results.empty():
+                    del running[i]
+                    summary[i]['status'] = 'error'
+                    print '>> Job %d died. (exit code %s)' \
+                        %(i + 1, p.exitcode)
+    return summary
+
+SUMMARY = ('job', 'model', 'constraints', 'slimit', 'ilimit', 'status',
+           'build', 'solve', 'solutions')
+
+def printSummary(summary):
+    secs = lambda t: t is None and '-' or '%.1f'%t
+    print '>> %-4s %-40s %-8s %-8s %-8s %s' \
+        %('job', 'model, constraints', 'status', 'build', 'solve',
+          'solutions')
+    for r in summary:
+        name = '%s, %s'%tuple(path.split('/')[-1] for path in
+                              (r['model'], r['constraints']))
+        print '>> %-4d %-40s %-8s %-8s %-8s %d' \
+            %(r['job'], name[:40], r['status'], secs(r['build']),
+              secs(r['solve']), r['solutions'])
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+        print "No manifest. ending."; quit()
+    if '-p' in sys.argv: # number of worker processes
+        nproc = int(sys.argv[sys.argv.index('-p') + 1])
+    else:
+        nproc = 1
+    if '-T' in sys.argv: # timeout of every job, in seconds
+        timeout = float(sys.argv[sys.argv.index('-T') + 1])
+    else:
+        timeout = 0
+    if '-t' in sys.argv: # horizon of trajectories
+        step = int(sys.argv[sys.argv.index('-t') + 1])
+    else:
+        step = STEP
+    if '-e' in sys.argv: # encoding backend, 'bv' or 'bool'
+        backend = sys.argv[sys.argv.index('-e') + 1]
+    else:
+        backend = 'bv'
+
+    jobs = readManifest(open(sys.argv[1]))
+    startt = time()
+    print '>> ' + "Batch of molle: %d jobs, %d processes "%(len(jobs), nproc) \
+        + '-' * 30
+    print '>> Start program: %s'%strftime("%d %b %H:%M", localtime(startt))
+    summary = runBatch(jobs, nproc, timeout, step, backend)
+    print '>> ' + '- ' * 15
+    printSummary(summary)
+    if '-w' in sys.argv: # write the summary as CSV
+        with open(sys.argv[sys.argv.index('-w') + 1], 'wb') as f:
+            writer = csv.DictWriter(f, SUMMARY)
+            writer.writeheader()
+            writer.writerows(summary)
+    print '>> Total duration:\t%s'%conv_time(time() - startt)
+    print '>> ' + '-' * 9 + ' Finished. ' + '-' * 9
@@ -0,0 +1,150 @@
+''' Benchmark the phases of molle over the problems of solve.INPUT.
+
+For every problem, the time of parsing (readModel, readExp), of build(),
+of the first solver check, and of every solution after the first one are taken
+in a process of its own, killed after the timeout. The results are written
+as JSON, with the backend and the z3 version, so that runs can be compared
+(with -C) across encodings and z3 versions.
+'''
+from molle import ABN, STEP
+from solve import INPUT, PREFIX
+from utility import readModel, readExp, conv_time
+from z3 import get_version_string
+from multiprocessing import Process, Queue
+from Queue import Empty
+from time import time, localtime, strftime
+import json, sys
+
+BENCH = ('ABCD_test', 'ABCD_kofe', 'logics_range_test', 'ABCD_nosolution',
+         'find_min_logic', 'find_minimal_model')
+
+def runProblem(problem, backend, step, nsol, results):
+    ''' Time the phases of a problem, reporting to the results Queue as
+    (phase, value) in turn; see bench(). '''
+    try:
+        mpath, epath = [ PREFIX + name for name in INPUT[problem] ]
+        start = time(); readModel(open(mpath))
+        results.put(('model', time() - start))
+        start = time(); readExp(open(epath))
+        results.put(('exp', time() - start))
+        model = ABN(open(mpath), open(epath), step, backend)
+        start = time(); model.build(detail=False)
+        results.put(('build', time() - start))
+        start = time(); result = model.solver.check()
+        results.put(('check', time() - start))
+        results.put(('sat', str(result)))
+        solutions = model.solve()
+        for n in range(nsol + 1):
+            start = time()
+            if next(solutions, None) is None: break
+            if n: results.put(('solution', time() - start))
+        results.put(('done', None))
+    except Exception as e:
+        results.put(('error', '%s: %s'%(type(e).__name__, e)))
+
+def bench(problem, backend='bv', step=STEP, nsol=10, timeout=0):
+    ''' Benchmark a problem in a worker process. Return a dict of the times
+    in seconds: parse (model, exp), build, check, and solutions (a list,
+    for the second solution on); with sat, the result of the check, and
+    status ('done', 'timeout' or 'error'). '''
+    results = Queue()
+    p = Process(target=runProblem,
+                args=(problem, backend, step, nsol, results))
+    p.daemon = True
+    p.start()
+    record = { 'parse': {}, 'build': None, 'check': None, 'sat': None,
+               'solutions': [], 'status': 'timeout' }
+    start = time()
+    while True:
+        wait = timeout and timeout - (time() - start)
+        if timeout and wait <= 0: break
+        try: phase, value = results.get(timeout=wait or None)
+        except Empty: break
+        if phase in ('model', 'exp'): record['parse'][phase] = value
+        elif phase == 'solution': record['solutions'].append(value)
+        elif phase == 'done': record['status'] = 'done'; break
+        elif phase == 'error':
+            record['status'] = 'error'; record['error'] = value; break
+        else: record[phase] = value
+    p.terminate(); p.join()
+    return record
+
+def _total(record, phase):
+    # the time of a phase of a record, or None
+    if record is None: return None
+    value = record.get(phase)
+    if phase == 'parse': return sum(value.values()) if value else None
+    if phase == 'solutions':
+        return value and sum(value) / len(value) or None
+    return value
+
+PHASES = ('parse', 'build', 'check', 'solutions')
+
+def compare(old, new, threshold=1.2, noise=0.05):
+    ''' Print the times of two runs side by side, marking the phases which
+    got slower (or faster) by more than threshold, and by more than noise
+    seconds. '''
+    print '>> old: z3 %s, %s; new: z3 %s, %s' \
+        %(old['z3'], old['backend'], new['z3'], new['backend'])
+    print '>> %-20s %-10s %10s %10s %8s' \
+        %('problem', 'phase', 'old', 'new', 'ratio')
+    for problem in sorted(set(old['problems']) | set(new['problems'])):
+        a = old['problems'].get(problem)
+        b = new['problems'].get(problem)
+        for phase in PHASES:
+            x, y = _total(a, phase), _total(b, phase)
+            if x is None and y is None: continue
+            fmt = lambda t: t is None and '-' or '%.3f'%t
+            ratio = x and y is not None and y / x
+            mark = ''
+            if ratio and abs(y - x) < noise: pass
+            elif ratio and ratio > threshold: mark = 'slower'
+            elif ratio and ratio < 1 / threshold: mark = 'faster'
+            print '>> %-20s %-10s %10s %10s %8s %s' \
+                %(problem, phase, fmt(x), fmt(y),
+                  ratio and '%.2f'%ratio or '-', mark)
+
+if __name__ == '__main__':
+    if '-C' in sys.argv: # compare two results
+        i = sys.argv.index('-C') + 1
+        old, new = [ json.load(open(path)) for path in sys.argv[i:i+2] ]
+        compare(old, new); quit()
+    if '-e' in sys.argv: # encoding backend, 'bv' or 'bool'
+        backend = sys.argv[sys.argv.index('-e') + 1]
+    else:
+        backend = 'bv'
+    if '-t' in sys.argv: # horizon of trajectories
+        step = int(sys.argv[sys.argv.index('-t') + 1])
+    else:
+        step = STEP
+    if '-n' in sys.argv: # number of solutions after the first one
+        nsol = int(sys.argv[sys.argv.index('-n') + 1])
+    else:
+        nsol = 10
+    if '-T' in sys.argv: # timeout of every problem, in seconds
+        timeout = float(sys.argv[sys.argv.index('-T') + 1])
+    else:
+        timeout = 600
+    if '-w' in sys.argv: # where to write the results
+        wpath = sys.argv[sys.argv.index('-w') + 1]
+    else:
+        wpath = 'bench-%s-%s.json'%(backend, strftime('%Y%m%d-%H%M'))
+    problems = [ a for a in sys.argv[1:] if a in INPUT ] or BENCH
+
+    run = { 'z3': get_version_string(), 'backend': backend, 'step': step,
+            'date': strftime('%Y-%m-%d %H:%M', localtime()),
+            'problems': {} }
+    for problem in problems:
+        print '>> Benchmarking %s...'%problem
+        record = run['problems'][problem] = \
+            bench(problem, backend, step, nsol, timeout)
+        fmt = lambda t: t is None and '-' or conv_time(t)
+        print '>> \t%s: parse %s, build %s, check %s (%s), %d more ' \
+            'solutions (%s each).' \
+            %(record['status'], fmt(_total(record, 'parse')),
+              fmt(record['build']), fmt(record['check']),
+              record['sat'] or '-', len(record['solutions']),
+              fmt(_total(record, 'solutions')))
+        if 'error' in record: print '>> \t%s'%record['error']
+    json.dump(run, open(wpath, 'w'), indent=2, sort_keys=True)
+    print '>> Results written to %s.'%wpath
@@ -2,77 +2,290 @@
 from z3 import *
 from utility import *
 from pprint import pprint
+from multiprocessing import Process, Queue
+from Queue import Empty
+from random import Random
+from time import time
+from hashlib import sha1
+import json, os
 
 
-STEP = 20 # trajectory length of the model
+STEP = 20 # default horizon: the longest trajectory of the model
+BACKENDS = ('bv', 'bool') # encode states/selections as BitVecs or Bools
+# solver configurations raced by ABN.race, as (strategy, params)
+PORTFOLIO = [ ('default', {}), ('qfbv', {}), ('bitblast', {}),
+              ('default', {'random_seed': 1}) ]
+CACHE = 1 # version of the format of the cached builds, see ABN.save
+COMPACT = 1000 # solutions between the compactions of blocking, see ABN.solve
 
 class ABN:
-    ''' The object receive input files: model = Model(mfile, efile) .
+    ''' The object receive input files: model = Model(mfile, efile, step) .
+    backend selects the encoding of states and selections, see BACKENDS.
 
     build(): Build the model by model.build(interaction_limit).
     solve(): Get the solutions by model.solve(solutions_limit) after build.
+    check(): Check a subset of experiments, after build(incremental=True).
+    psolve(): Get the solutions with worker processes, no build needed.
+    race(): Race solver configurations on the built model, keep the winner.
+    reach(): The shortest trajectory between two states of a solution.
+    report(): The time and size of the build phases, and the solver
+              statistics of every solve() iteration.
     '''
     
-    def __init__(self, mfile, efile):
-        (self.species, self.logics, self.kofe,
-         self.defI, self.optI) = readModel(mfile)
-        (self.exps, self.states) = readExp(efile)
+    def __init__(self, mfile, efile, step=STEP, backend='bv',
+                 strategy='default', **params):
+        assert backend in BACKENDS
+        problem = readProblem(mfile, efile)
+        (self.species, self.logics, self.kofe, self.defI, self.optI,
+         self.exps, self.states) = problem[:7]
+        # name -> index dicts, and the states with the names resolved
+        (self.index, self.koIndex, self.feIndex, self.bits) = problem[7:]
+        # all avalible acts and reps for every specie; Concat is from L to R
+        self.inters = dict((c, (self.optI[c][0] + self.defI[c][0],
+                                self.optI[c][1] + self.defI[c][1]))
+                           for c in range(len(self.species)))
+        # what the model and the experiments are, for the cached builds
+        self.digest = sha1(json.dumps(
+            [self.species, self.logics, self.kofe, self.defI, self.optI,
+             self.exps, self.states], sort_keys=True)).hexdigest()
+        self.step = step # horizon; every trajectory is cut to its last time
+        self.backend = backend
+        self.strategy, self.params = strategy, params # see makeSolver
+        self.blocked = [] # records of resumed solutions, see resume
+        self.pruned = None # logics dropped by prune()
         self.built = False
 
-    def build(self, ilimit=0, detail=True, debug=False):
-        ''' Add all constrains, and set self.solver. '''
-        bitlen = len(self.species)
-        kos, fes = self.kofe['KO'], self.kofe['FE']        
-        solver = Solver()
-    
-        # 0. Encoding functions
+    def network(self):
+        ''' Return the (A, R, L) dicts if the model file leaves no choice
+        (no optional interactions, one logic per specie), or None. '''
+        self.prune()
+        A = {}; R = {}; L = {}
+        for c, s in enumerate(self.species):
+            acts, reps = self.defI[c]
+            logics = self.logics[s]
+            if self.optI[c][0] or self.optI[c][1] or len(logics) != 1:
+                return None
+            A[s] = [ self.species[i] for i in acts ]
+            R[s] = [ self.species[i] for i in reps ]
+            L[s] = logics[0]
+        return (A, R, L)
+
+    def prune(self):
+        ''' Drop the logics which make no difference, before the build.
+
+        After compati, a logic is dropped if its rule is the same as the one
+        of a smaller logic (see ruleClasses), or if its rule is a constant
+        which some observation of the specie rules out (see needs). Return
+        the dropped logics with the reasons, { specie: [(logic, reason)] },
+        also kept as self.pruned.
+        '''
+        if self.pruned is not None: return self.pruned
+        need = self.needs()
+        self.pruned = {}
+        for c, s in enumerate(self.species):
+            dropped = self.pruned[s] = []
+            ta = len(self.optI[c][0]) + len(self.defI[c][0])
+            tr = len(self.optI[c][1]) + len(self.defI[c][1])
+            logics = compati(self.logics[s], ta, tr)
+            dropped.extend([ (l, 'compati') for l in self.logics[s]
+                             if l not in logics ])
+            # defined regulators come last, see build
+            defA = [ i >= len(self.optI[c][0]) for i in range(ta) ]
+            defR = [ i >= len(self.optI[c][1]) for i in range(tr) ]
+            kept = []
+            for members, constant in ruleClasses(logics, defA, defR):
+                first = members[0]
+                dropped.extend([ (l, 'same rule as %d'%first)
+                                 for l in members[1:] ])
+                if constant is not None and (not constant) in need[s]:
+                    dropped.append((first, 'always %d, observed %d'
+                                    %(constant, not constant)))
+                else:
+                    kept.append(first)
+            # no logic fits: the model has no solution; keep one for it
+            self.logics[s] = tuple(sorted(kept)) or (-1, )
+        return self.pruned
+
+    def needs(self):
+        ''' The values the update rule of every specie must give, somewhere:
+        the values observed after a step, or at a stable state, which a KO/FE
+        of the experiment cannot explain. Return { specie: set of bools }. '''
+        koI, feI = self.koIndex, self.feIndex
+        need = dict((s, set()) for s in self.species)
+        for name, exp in self.exps.items():
+            fixed = {} # observed KO/FE bits, { (vector, i): bool }
+            stable = set() # times of stable states
+            for t, conditions in exp:
+                for cond in conditions:
+                    if cond == STABLE: stable.add(t); continue
+                    fixed.update(((v, i), b) for v, i, b in self.bits[cond]
+                                 if v != 'Q')
+            for t, conditions in exp:
+                if t == 0 and t not in stable: continue # no step before
+                for cond in conditions:
+                    if cond == STABLE: continue
+                    for v, c, b in self.bits[cond]:
+                        if v != 'Q': continue
+                        s = self.species[c]
+                        fe = s in feI and \
+                             fixed.get(('FE', feI[s])) is not False
+                        ko = s in koI and \
+                             fixed.get(('KO', koI[s])) is not False
+                        if b and fe: continue
+                        if not b and ko and \
+                           fixed.get(('FE', feI.get(s))) is not True:
+                            continue
+                        need[s].add(b)
+        return need
+
+    def vector(self, name, n):
+        ''' Make a vector of n bits in the current backend. '''
+        return makeVector(name, n, self.backend == 'bool')
+
+    def makeSolver(self, strategy=None, **params):
+        ''' A new solver of the strategy (default: self.strategy, with
+        self.params), see utility.makeSolver. '''
+        if strategy is None: strategy, params = self.strategy, self.params
+        return makeSolver(strategy, **params)
+
+    def race(self, configs=PORTFOLIO, exps=None, timeout=None):
+        ''' Check the built model with every solver configuration, as
+        (strategy, params), in processes of their own; the first to answer
+        wins ('unknown', or an error, is no answer). Its configuration
+        becomes the one of the model, with a new solver. Return (strategy,
+        params, result, secs), or None if none answers within timeout
+        seconds (no limit if None), or all fail. '''
+        assert self.built
+        results = Queue()
+        workers = [ Process(target=_race,
+                            args=(self, i, configs[i], exps, results))
+                    for i in range(len(configs)) ]
+        for w in workers:
+            w.daemon = True
+            w.start()
+        start, answers = time(), 0
+        try:
+            while answers < len(configs):
+                wait = timeout and timeout - (time() - start)
+                if timeout and wait <= 0: return None
+                try: i, result, secs = results.get(timeout=min(wait or 1, 1))
+                except Empty:
+                    # a worker may die without an answer
+                    if any(w.is_alive() for w in workers): continue
+                    try: i, result, secs = results.get(timeout=0.1)
+                    except Empty: return None
+                answers += 1
+                if result not in ('unknown', 'error'): break # the winner
+            else:
+                return None
+        finally:
+            for w in workers: w.terminate()
+        strategy, params = configs[i]
+        if (strategy, params) != (self.strategy, self.params):
+            solver = self.makeSolver(strategy, **params)
+            solver.add(self.solver.assertions())
+            self.strategy, self.params, self.solver = strategy, params, solver
+            self.profile.solver = solver
+        return (strategy, params, result, secs)
+
+    def known(self, name, n, known):
+        ''' A vector of n bits with the known ones fixed, see makeKnown. '''
+        return makeKnown(name, n, known, self.backend == 'bool')
+
+    def encode(self):
+        ''' Make the selection vectors and the functions of all species
+        (step 0 of build), and self.opts, the Bool exprs of all optional
+        interactions. '''
         self.A_ = {} # of activator/activating-interaction selection BitVec
         self.R_ = {} # of repressor/repressing-interaction selection BitVec
         self.L_ = {} # of Logic-selecting BitVec for speciew
         self.f_ = {} # devices/modules/functions
-        self.inters = {} # record all avalible acts and reps for every specie
         for c, s in enumerate(self.species):
-            acts = self.optI[c][0] + self.defI[c][0] # Concat is from L to R
-            reps = self.optI[c][1] + self.defI[c][1]
-            self.inters[c] = (acts, reps)
-            # filter the useless functiono
-            ta = sum(map(len, ( self.optI[c][0], self.defI[c][0] )))
-            tr = sum(map(len, ( self.optI[c][1], self.defI[c][1] )))
-            self.logics[s] = compati(self.logics[s], ta, tr)
-            
+            acts, reps = self.inters[c]
+
             # creating Act and Rep selecting BitVec
-            if acts: self.A_[s] = BitVec('Act_' + s, len(acts))
+            if acts: self.A_[s] = self.vector('Act_' + s, len(acts))
             else: self.A_[s] = None
-            if reps: self.R_[s] = BitVec('Rep_' + s, len(reps))
+            if reps: self.R_[s] = self.vector('Rep_' + s, len(reps))
             else: self.R_[s] = None
             
             # create logic-selecting BitVec
-            self.L_[s] = BitVec('Logic_' + s, len(self.logics[s]))
+            self.L_[s] = self.vector('Logic_' + s, len(self.logics[s]))
             
             # make the functions
-            kofe_index = (s in kos and kos.index(s) + 1,
-                          s in fes and fes.index(s) + 1)
+            kofe_index = (s in self.koIndex and self.koIndex[s] + 1,
+                          s in self.feIndex and self.feIndex[s] + 1)
             self.f_[s] = [ makeFunction(acts, reps, kofe_index,
                                         l, self.A_[s], self.R_[s])
                            for l in self.logics[s] ]
+        # the Act_/Rep_ vectors, in the order of the packed Solution bits
+        self.packing = [ v for s in self.species
+                         for v in (self.A_[s], self.R_[s]) if v is not None ]
+
+        self.opts = [] # all optional interactions, as Bool exprs
+        for c, s in enumerate(self.species):
+            actn, repn = map(len,self.optI[c]) # nums of ats and reps
+            # optional interactions are the leftmost bits
+            for v, n in ((self.A_[s], actn), (self.R_[s], repn)):
+                if v is None: continue
+                self.opts.extend([ bitOf(v, i) for i in
+                                   range(widthOf(v) - n, widthOf(v)) ])
+
+    def build(self, ilimit=0, detail=True, debug=False, incremental=False,
+              cache=None):
+        ''' Add all constrains, and set self.solver.
+
+        With incremental, the constrains of every experiment are guarded by
+        an indicator Bool (self.E_), so that experiments can be switched on
+        and off by check() within one solver session.
+
+        cache is a directory of built models (see save): the model is loaded
+        from it if it was built there before, and saved to it otherwise.
+        '''
+        bitlen = len(self.species)
+        kos, fes = self.kofe['KO'], self.kofe['FE']        
+        solver = self.makeSolver()
+        profile = self.profile = Profile(solver)
+        if cache:
+            cached = os.path.join(cache, self.cacheKey(ilimit, incremental))
+            if os.path.exists(cached + '.json'):
+                self.load(cached, solver)
+                profile.phase('#0 cache')
+                if detail: print '>> Constrains loaded from %s.smt2'%cached
+                return self.finish(solver)
+        self.prune()
+        profile.phase('#0 pruning')
+    
+        # 0. Encoding functions
+        self.encode()
 
         if debug:
             print '>> Species:';
             pprint([ (s, self.logics[s]) for s in self.species ])
+            print '>> Pruned logics:'; pprint(self.pruned)
             print '>> Defined Iteractions:'; pprint(self.defI)
             print '>> Optional Interactions:'; pprint(self.optI)
             print '>> KO: ', kos
             print '>> FE: ', fes
 
+        profile.phase('#0 encoding')
+
         # 1. Modeling Constrains
         if detail:
+            print '>> #0 %d logics pruned.' \
+                %sum(len(v) for v in self.pruned.values())
             print '>> #1 Adding modeling constrains: '
         for c, s in enumerate(self.species):
             # INTER: defined activators and repressors must be selected
             defactn, defrepn = map(len, self.defI[c])
-            solver.add([ 1== Extract(i,i,self.A_[s]) for i in range(defactn) ])
-            solver.add([ 1== Extract(i,i,self.R_[s]) for i in range(defrepn) ])
+            solver.add([ bitOf(self.A_[s], i) for i in range(defactn) ])
+            solver.add([ bitOf(self.R_[s], i) for i in range(defrepn) ])
             
+            if self.backend == 'bool':
+                # LOGIC: select exactly one logic
+                solver.add(AtMost(*(self.L_[s] + [1])), Or(self.L_[s]))
+                continue
+
             # LOGIC: only one logic is selected
             logic_i = range(self.L_[s].size())
             solver.add(
@@ -89,99 +302,635 @@ class ABN:
                       self.L_[s].sort(), isExpOf2(solver.model()[self.L_[s]]))
 
 
+        profile.phase('#1 modeling')
+
         # 2. Interactions limit (only for optional interactions)
-        opts = [] # all optional interactions
-        if ilimit:
-            for c, s in enumerate(self.species):
-                actn, repn = map(len,self.optI[c]) # nums of ats and reps
-                # fill the allOpt list with all optional interactions
-                if self.A_[s]:
-                    a, b = self.A_[s].size() - actn, self.A_[s].size()
-                    opts.extend([ Extract(i,i,self.A_[s]) for i in range(a,b)])
-                if self.R_[s]:
-                    a, b = self.R_[s].size() - repn, self.R_[s].size()
-                    opts.extend([ Extract(i,i,self.R_[s]) for i in range(a,b)])
-            # all selected nums of inters are less than limit
-            solver.add(ULE(sum([ ZeroExt(6, bv) for bv in opts ]),
-                           ilimit))
+        if ilimit and self.opts:
+            # all selected nums of inters are less than limit; a cardinality
+            # constrain, instead of an adder over the bits
+            solver.add(AtMost(*(self.opts + [ilimit])))
             if detail:
                 print '>> #2 Interactions limit %d ADDED. %s' \
                     %(ilimit, debug and solver.check() or "not-check.")
         else:
             if detail: print '>> #2 Interactions limit: NOT SET.'
         
+        profile.phase('#2 ilimit')
+
         # 3. Experimental constrains
         if detail:
             print '>> #3 Applying experimental constraints:'
-        total_exp = len(self.exps)
+        self.E_ = {} # experiment-indicating Bool, if incremental
+        # experiments from the same, fully observed, initial state and KO/FE
+        # follow the same trajectory, so they share one path; not with
+        # incremental, where every experiment is switched on its own
+        groups = OrderedDict()
+        for name in self.exps:
+            length, known, stable, clash = self.observe([name])
+            full = (len(known[0]) == bitlen and len(known['KO']) == len(kos)
+                    and len(known['FE']) == len(fes))
+            if full and not incremental:
+                key = tuple(tuple(sorted(known[k].items()))
+                            for k in (0, 'KO', 'FE'))
+            else:
+                key = name
+            groups.setdefault(key, []).append(name)
+        total_exp = len(groups)
         count_exp = 0
-        for name, exp in self.exps.items():
+        for names in groups.values():
             count_exp += 1
-            # build updating path
-            ko_exp = BitVec(name + '_KO', len(kos) or 1)
-            fe_exp = BitVec(name + '_FE', len(fes) or 1)
-            path = [ BitVec(name + '_%d'%t, bitlen) for t in range(STEP) ]
+            name = names[0]
+            length, known, stable, clash = self.observe(names)
+            # the observed bits are folded into the path, KO and FE as
+            # constants, instead of asserted over free bits
+            ko_exp = self.known(name + '_KO', len(kos) or 1, known['KO'])
+            fe_exp = self.known(name + '_FE', len(fes) or 1, known['FE'])
+            path = [ self.known(name + '_%d'%t, bitlen, known[t])
+                     for t in range(length) ]
             #solver.add(*[ T(path[t], path[t+1], KO, FE)
             #              for t in range(STEP-1) ])
-            solver.add(self.bunchT(path, ko_exp, fe_exp))
-            # add constrains
-            for t, conditions in exp:
-                for cond in conditions:
-                    for s, value in self.states[cond]:
-                        if s[:3] == 'KO_':
-                            c = kos.index(s[3:])
-                            solver.add( Extract(c,c,ko_exp) == value )
-                        elif s[:3] == 'FE_':
-                            c = fes.index(s[3:])
-                            solver.add( Extract(c,c,fe_exp) == value )
-                        else:
-                            c = self.species.index(s)
-                            solver.add( Extract(c,c,path[t]) == value )
+            cons = [ self.bunchT(path, ko_exp, fe_exp) ]
+            cons.extend([ self.T(path[t], path[t], ko_exp, fe_exp)
+                          for t in stable ])
+            if clash: cons.append(BoolVal(False)) # contradicting observations
+            encoded = time() - profile.start # terms made, not yet added
+            if incremental:
+                self.E_[name] = Bool('Exp_' + name)
+                solver.add(Implies(self.E_[name], And(cons)))
+            else:
+                solver.add(cons)
             if detail:
-                print '>> \t %02d/%d %s added...'%(count_exp, total_exp, name)
+                print '>> \t %02d/%d %s added (%d steps%s)...' \
+                    %(count_exp, total_exp, ', '.join(names), length,
+                      len(names) > 1 and ', one path' or '')
+            profile.phase('#3 ' + ', '.join(names), encode=encoded,
+                          steps=length)
+
+        if cache:
+            self.save(cached, solver)
+            if detail: print '>> Constrains saved to %s.smt2'%cached
+        self.finish(solver)
+
+    def finish(self, solver):
+        ''' The end of build(), after the constrains are added to solver. '''
+        # 4. Solutions found before (see resume)
+        self.tables = None # truth tables for semantic solve(), if needed
+        solver.add([ self.unlike(record) for record in self.blocked ])
+        self.profile.phase('#4 blocked')
 
         self.solver = solver
         self.built = True
 
+    def cacheKey(self, ilimit=0, incremental=False):
+        ''' The name of the cached build of the model, see build. '''
+        return sha1(json.dumps([CACHE, self.digest, self.step, self.backend,
+                                ilimit, incremental])).hexdigest()
+
+    def save(self, path, solver):
+        ''' Write the assertions of solver as SMT-LIB2 to path.smt2 (which
+        any SMT solver can read), and what load() needs with them as JSON to
+        path.json: species, inters, logics and the pruned logics, and the
+        indicators of the experiments, if incremental. '''
+        meta = { 'version': CACHE, 'species': self.species,
+                 'inters': self.inters, 'logics': self.logics,
+                 'pruned': self.pruned, 'backend': self.backend,
+                 'step': self.step, 'experiments': self.E_.keys() }
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        for name, text in ((path + '.smt2', solver.sexpr() + '(check-sat)\n'),
+                           (path + '.json', json.dumps(meta, sort_keys=True))):
+            with open(name + '.tmp', 'w') as f: f.write(text)
+            os.rename(name + '.tmp', name) # the .json last: then it is whole
+        
+    def load(self, path, solver):
+        ''' Add the assertions saved to path by save() to solver, and set up
+        the vectors and functions over them, as build() would. '''
+        meta = json.load(open(path + '.json'))
+        self.logics = dict((str(s), tuple(l))
+                           for s, l in meta['logics'].items())
+        self.pruned = dict((str(s), [ tuple(p) for p in l ])
+                           for s, l in meta['pruned'].items())
+        self.encode()
+        solver.add(parse_smt2_file(path + '.smt2'))
+        self.E_ = dict((str(name), Bool('Exp_' + name))
+                       for name in meta['experiments'])
+
+    def observe(self, names):
+        ''' The observations of the experiments names, taken as one path.
+        Return (length, known, stable, clash): the length of the path, up to
+        the last observed step; the observed bits, as { t or 'KO'/'FE':
+        { index: bool } }; the times of stable states; and if two of the
+        observations contradict. '''
+        length = 0
+        for name in names:
+            n = max(t for t, conditions in self.exps[name]) + 1
+            if n > self.step:
+                raise ValueError('%s constrains step %d, out of horizon %d'
+                                 %(name, n - 1, self.step))
+            length = max(length, n)
+        known = dict((t, {}) for t in range(length))
+        known['KO'], known['FE'] = {}, {}
+        stable, clash = [], False
+        for name in names:
+            for t, conditions in self.exps[name]:
+                for cond in conditions:
+                    if cond == STABLE: # no need to unroll beyond t
+                        stable.append(t); continue
+                    for v, c, b in self.bits[cond]:
+                        old = known[t if v == 'Q' else v].setdefault(c, b)
+                        clash = clash or old != b
+        return (length, known, sorted(set(stable)), clash)
+
     def T(self, q_old, q_new, ko, fe):
         ''' Define Transition ralationship. It is like a macro.'''
         return \
           And([
-            And([Implies(Extract(l, l, self.L_[s]) == 1,
-                         (Extract(c,c,q_new)==1) == self.f_[s][l](q_old,ko,fe))
-                 for l in range(self.L_[s].size())])
+            And([Implies(bitOf(self.L_[s], l),
+                         bitOf(q_new, c) == self.f_[s][l](q_old,ko,fe))
+                 for l in range(widthOf(self.L_[s]))])
             for c, s in enumerate(self.species) ])
 
     def bunchT(self, qs, ko, fe):
         ''' this manner is a little bit more quicker.'''
         return \
           And([
-            And([ Implies(Extract(l, l, self.L_[s]) == 1,
-                          And([ (Extract(c, c, qs[t+1])==1) == \
+            And([ Implies(bitOf(self.L_[s], l),
+                          And([ bitOf(qs[t+1], c) == \
                                 self.f_[s][l](qs[t], ko, fe)
-                                for t in range(STEP-1)]) )
-                  for l in range(self.L_[s].size()) ])
+                                for t in range(len(qs)-1)]) )
+                  for l in range(widthOf(self.L_[s])) ])
             for c, s in enumerate(self.species) ])
 
-    def solve(self):
-        ''' Get the solutions. return an iterator.'''
+    def solve(self, exps=None, semantic=False, compact=COMPACT):
+        ''' Get the solutions. return an iterator.
+        exps selects the experiments to apply, if built incremental.
+
+        By default every selection of interactions is a solution. With
+        semantic, only one solution per network of distinct update functions
+        is given: its whole equivalence class of logics and interactions is
+        blocked at once, by the truth tables of the functions.
+
+        Otherwise, every compact solutions the solver is made again from the
+        assertions of the build, with the solutions so far merged into cubes
+        (see mergeCubes), so that the blocking clauses do not pile up.
+        '''
+        assert self.built
+        assumptions = self.assumptions(exps)
+        if semantic: table = self.table()
+        base = self.solver.assertions()
+        full = (1 << sum(map(widthOf, self.packing))) - 1
+        cubes, found = [], [] # blocked before the last compaction, and since
+        if self.E_: self.solver.push() # keep the blocking clauses local
+        try:
+            while True:
+                start = time()
+                result = self.solver.check(assumptions)
+                self.profile.check(time() - start, result)
+                if result != sat: break
+                m = self.solver.model()
+                solution = self.solution(m)
+                if semantic:
+                    solution.function = tuple([ is_true(m.eval(f, True))
+                                                for f in table ])
+                    yield solution
+                    self.solver.add(Or([ f != v for f, v in
+                                         zip(table, solution.function) ]))
+                else:
+                    yield solution
+                    self.solver.add(self.differs(solution.bits))
+                    found.append((full, solution.packed))
+                    if compact and len(found) == compact:
+                        cubes, found = mergeCubes(cubes + found), []
+                        self.solver = self.profile.solver = self.makeSolver()
+                        self.solver.add(base)
+                        if self.E_: self.solver.push()
+                        self.solver.add(self.blocking(cubes))
+        finally:
+            if self.E_: self.solver.pop()
+
+    def solution(self, m):
+        ''' The Solution of model m. Need build. '''
+        return Solution(self.species, self.inters, packOf(m, self.packing),
+                        getLogics(m, self.L_, self.species, self.logics))
+
+    def blocking(self, cubes):
+        ''' Clauses: the Act_/Rep_ selections are out of the cubes, as (mask,
+        value) over the packed bits of a Solution. '''
+        clauses = []
+        for mask, value in cubes:
+            clause, shift = [], 0
+            for v in reversed(self.packing):
+                w = widthOf(v)
+                vm, vv = [ x >> shift & (1 << w) - 1 for x in (mask, value) ]
+                shift += w
+                if not vm: continue
+                if isinstance(v, list): # bool backend
+                    clause.extend([ v[i] != bool(vv >> i & 1)
+                                    for i in range(w) if vm >> i & 1 ])
+                elif vm == (1 << w) - 1: clause.append(v != vv)
+                else: clause.append(v & vm != vv)
+            clauses.append(Or(clause))
+        return clauses
+
+    def report(self):
+        ''' The profile of the last build() and of the solve() iterations
+        since, as a dict: build, a list of the phases with their wall time
+        (time), the terms asserted (terms) and, for the experiments, the
+        time to make the terms (encode); solve, a list of the checks with
+        their time, result and solver statistics. '''
+        profile = self.profile
+        return { 'backend': self.backend, 'species': len(self.species),
+                 'experiments': len(self.exps),
+                 'build': profile.phases, 'solve': profile.checks,
+                 'build time': sum(p['time'] for p in profile.phases),
+                 'solve time': sum(c['time'] for c in profile.checks),
+                 'terms': profile.terms }
+
+    def projection(self):
+        ''' All Act_/Rep_/Logic_ bits, as Bool exprs. '''
+        vectors = self.A_.values() + self.R_.values() + self.L_.values()
+        return [ bitOf(v, i) for v in vectors if v is not None
+                 for i in range(widthOf(v)) ]
+
+    def weights(self):
+        ''' The number of logics of the model file which every kept logic
+        stands for, after prune(): { specie: { logic: number } }. '''
+        weights = {}
+        for s in self.species:
+            w = weights[s] = dict((l, 1) for l in self.logics[s])
+            for l, reason in self.pruned[s]:
+                if reason.startswith('same rule as '):
+                    first = int(reason.split()[-1])
+                    if first in w: w[first] += 1
+        return weights
+
+    def _bounded(self, solver, limit, weights):
+        ''' Count the Act_/Rep_/Logic_ assignments of solver up to limit,
+        blocking them in its current scope. Return (number, weighted number)
+        of them, with the logics weighted by weights (see count). '''
+        parts = sum([ partsOf(v) for v in self.A_.values() +
+                      self.R_.values() + self.L_.values() if v is not None ],
+                    [])
+        n = w = 0
+        while n < limit and solver.check() == sat:
+            m = solver.model()
+            n += 1
+            logic = getLogics(m, self.L_, self.species, self.logics)
+            w += reduce(lambda x, y: x * y,
+                        [ weights[s][l] for s, l in zip(self.species, logic) ])
+            solver.add(Or([ p != m.eval(p, True) for p in parts ]))
+        return n, w
+
+    def count(self, exact=512, cell=64, split=4, rounds=5, seed=0, exps=None):
+        ''' Count the networks consistent with the model, without
+        enumerating all of them. A network is a selection of interactions
+        and of a logic of the model file (allowed by compati) for every
+        specie; the logics of the same rule, merged by prune(), are counted
+        apart again (see weights), as if nothing had been pruned.
+
+        Up to exact kept assignments, they are counted exactly, cube by cube
+        (see cubes). Beyond, the count is estimated by hashing: random XOR
+        constrains over the bits are added until at most cell assignments
+        are left, and their count is scaled by 2 ** XORs; this is repeated
+        rounds times. One solver is used throughout, the cubes, XORs and
+        blocking clauses being pushed and popped. Return (count, low, high),
+        where count is exact (and equals low and high), or the median of the
+        estimates and low/high are the smallest/largest ones.
+        '''
         assert self.built
-        allAR = filter(None, list(self.A_.values()) + list(self.R_.values()))
-        while self.solver.check() == sat:
-            m = self.solver.model()
-            yield Solution(m, self.A_, self.R_, self.L_,
-                           self.species, self.inters, self.logics)
-            self.solver.add(Or([ b != (m[b] or 0) for b in allAR]))
-
-class Solution:
-    ''' A printable solution object. '''
-    def __init__(self, m, A_, R_, L_, species, itrs, lgcs):
-        self.species = species
-        # interpreted the solution 
-        self.A, self.R, self.L = getDetail(m, A_, R_, L_, species, itrs, lgcs)
-
-    def output(self, config=True, model=True):
-        printModel(self.species, self.A, self.R, self.L)
+        weights = self.weights()
+        solver = self.makeSolver()
+        solver.add(self.solver.assertions())
+        solver.add(self.assumptions(exps))
+        n = total = 0
+        for cube in self.cubes(split):
+            solver.push()
+            solver.add([ self.literal(lit) for lit in cube ])
+            k, w = self._bounded(solver, exact + 1 - n, weights)
+            solver.pop()
+            n, total = n + k, total + w
+            if n > exact: break
+        else:
+            return (total, total, total)
+        bits = self.projection()
+        rng = Random(seed)
+        estimates = []
+        for r in range(rounds):
+            solver.push() # the XORs of the round
+            xors = 0
+            while True:
+                chosen = [ b for b in bits if rng.random() < 0.5 ] or bits[:1]
+                solver.add(reduce(Xor, chosen) == (rng.random() < 0.5))
+                xors += 1
+                solver.push() # the blocking clauses of the cell
+                k, w = self._bounded(solver, cell + 1, weights)
+                solver.pop()
+                if k <= cell: break
+            solver.pop()
+            estimates.append(w * 2 ** xors)
+        estimates.sort()
+        return (estimates[len(estimates) / 2], estimates[0], estimates[-1])
+
+    def table(self):
+        ''' The truth tables of the update functions of all species, as a
+        list of Bool exprs over the selections: the next value of specie s
+        when exactly the regulators in x (a subset of its candidates) are
+        on, for every s and x. KO/FE are left out; they are the same for all
+        the choices of a specie. '''
+        if self.tables is not None: return self.tables
+        n = len(self.species)
+        kos, fes = self.kofe['KO'], self.kofe['FE']
+        boolean = self.backend == 'bool'
+        ko = makeConst(0, len(kos) or 1, boolean)
+        fe = makeConst(0, len(fes) or 1, boolean)
+        self.tables = []
+        for c, s in enumerate(self.species):
+            regs = sorted(set(self.inters[c][0] + self.inters[c][1]))
+            for x in range(2 ** len(regs)):
+                q = makeConst(sum([ 1 << r for j, r in enumerate(regs)
+                                    if x >> j & 1 ]), n, boolean)
+                self.tables.append(simplify(Or([
+                    And(bitOf(self.L_[s], l), self.f_[s][l](q, ko, fe))
+                    for l in range(widthOf(self.L_[s])) ])))
+        return self.tables
+
+    def differs(self, bits):
+        ''' A clause: the Act_/Rep_ selections differ from the assignment bits
+        (see Solution.bits). '''
+        vectors = dict([ ('Act_' + s, v) for s, v in self.A_.items() ] +
+                       [ ('Rep_' + s, v) for s, v in self.R_.items() ])
+        clause = []
+        for name, b in bits.items():
+            v = vectors[name]
+            if isinstance(v, list): # bool backend
+                clause.extend([ v[i] != (b[-1-i] == '1')
+                                for i in range(len(v)) ])
+            else:
+                clause.append(v != int(b, 2))
+        return Or(clause)
+
+    def unlike(self, record):
+        ''' A clause blocking the record of a solution: its Act_/Rep_
+        assignment (a dict, see differs), or the truth tables of its
+        functions (a list, from a semantic solve(); see table). '''
+        if isinstance(record, dict): return self.differs(record)
+        return Or([ f != v for f, v in zip(self.table(), record) ])
+
+    def resume(self, records):
+        ''' Block the records (e.g. from a Checkpoint; see unlike) of the
+        solutions found before, so that the enumeration carries on from
+        there. The records of a semantic solve() must be resumed by one. '''
+        self.blocked.extend(records)
+        if self.built:
+            self.solver.add([ self.unlike(record) for record in records ])
+
+    def minimize(self, logic=False, exps=None, fix=True):
+        ''' Find a model with the fewest optional interactions (and then, if
+        logic, the least logic complexity: the sum of the selected logic
+        numbers) by z3 Optimize. Return (interactions, complexity, solution),
+        or None if unsat. With fix, the minimum is added to self.solver, so
+        that solve() only enumerates the minimal models.
+        '''
+        assert self.built
+        opt = Optimize()
+        opt.add(self.solver.assertions())
+        opt.add(self.assumptions(exps)) # no assumptions in Optimize
+        inters = Sum([ If(b, 1, 0) for b in self.opts ] + [IntVal(0)])
+        complexity = self.complexity()
+        opt.minimize(inters)
+        if logic: opt.minimize(complexity) # lexicographic, after inters
+        if opt.check() != sat: return None
+        m = opt.model()
+        n, c = [ m.eval(e).as_long() for e in (inters, complexity) ]
+        if fix: self.bound(n, c if logic else None)
+        return (n, c, self.solution(m))
+
+    def complexity(self):
+        ''' The logic complexity, the sum of the selected logic numbers, as
+        a z3 Int expr. Need build. '''
+        return Sum([ If(bitOf(self.L_[s], l), max(n, 0), 0)
+                     for s in self.species
+                     for l, n in enumerate(self.logics[s]) ])
+
+    def bound(self, inters=None, complexity=None):
+        ''' Add the bounds on the optional interactions and on the logic
+        complexity (see minimize), if not None, to self.solver. '''
+        if inters is not None and self.opts:
+            self.solver.add(AtMost(*(self.opts + [inters])))
+        if complexity is not None:
+            self.solver.add(self.complexity() <= complexity)
+
+    def assumptions(self, exps=None):
+        ''' Indicators enabling the given experiments (default: all).'''
+        if exps is None: exps = self.E_.keys()
+        return [ self.E_[name] for name in exps ]
+
+    def check(self, exps=None):
+        ''' Check if the experiments (default: all) can be satisfied together.
+        Need build(incremental=True). Learned clauses are kept between calls.
+        '''
+        assert self.built and self.E_
+        return self.solver.check(self.assumptions(exps))
+
+    def conflict(self):
+        ''' The experiments in the unsat core of the last unsat check().
+        Only the default strategy gives cores; the tactic ones (see
+        utility.STRATEGIES) give none. '''
+        if self.strategy != 'default':
+            raise ValueError('no unsat core with the %s strategy'
+                             %self.strategy)
+        core = set(str(b) for b in self.solver.unsat_core())
+        return [ name for name in self.E_ if str(self.E_[name]) in core ]
+
+    def cubes(self, n):
+        ''' Split the selection space into (at least n) disjoint cubes.
+
+        A cube is a tuple of literals: ('I', s, k, i, v) sets the i-th
+        optional activator (k = 0) or repressor (k = 1) of specie s to v, and
+        ('L', s, logic) selects the logic of s. Interactions are split first,
+        as solve() only blocks on them; logic cubes may share solutions.
+        '''
+        splits = []
+        for c, s in enumerate(self.species):
+            for k in (0, 1):
+                splits.extend([ [ ('I', s, k, i, v) for v in (0, 1) ]
+                                for i in range(len(self.optI[c][k])) ])
+        splits.extend(sorted([ [ ('L', s, l) for l in self.logics[s] ]
+                               for s in self.species
+                               if len(self.logics[s]) > 1 ],
+                             key=len, reverse=True))
+        cubes = [()]
+        for split in splits:
+            if len(cubes) >= n: break
+            cubes = [ cube + (lit,) for cube in cubes for lit in split ]
+        return cubes
+
+    def literal(self, lit):
+        ''' Convert a cube literal to a z3 expr. Need build. '''
+        if lit[0] == 'L':
+            s, l = lit[1:]
+            if l not in self.logics[s]: return BoolVal(False) # pruned
+            return bitOf(self.L_[s], self.logics[s].index(l))
+        s, k, i, v = lit[1:]
+        bv = (self.A_, self.R_)[k][s]
+        b = widthOf(bv) - 1 - i # optional inters are the leftmost bits
+        return bitOf(bv, b) == (v == 1)
+
+    def psolve(self, nproc, ilimit=0, split=4, semantic=False, bounds=()):
+        ''' Parallel solve(). The selection space is cut into disjoint cubes,
+        which are enumerated by nproc worker processes, each with its own
+        rebuilt solver, with the bounds of bound() (e.g. the minimum from
+        minimize). Return an iterator of unique solutions, in the order they
+        arrive.
+        '''
+        tasks, results = Queue(), Queue()
+        for cube in self.cubes(nproc * split): tasks.put(cube)
+        workers = [ Process(target=_enumerate,
+                            args=(self, ilimit, semantic, bounds, tasks,
+                                  results))
+                    for i in range(nproc) ]
+        for w in workers:
+            tasks.put(None) # one stop sign for each worker
+            w.daemon = True
+            w.start()
+        seen = set()
+        running = nproc
+        try:
+            while running:
+                record = results.get()
+                if record is None:
+                    running -= 1; continue
+                packed, logic, function = record
+                key = function or packed
+                if key in seen: continue
+                seen.add(key)
+                yield Solution(self.species, self.inters, packed, logic,
+                               function)
+        finally:
+            for w in workers: w.terminate()
+
+    def reach(self, solution, source, target, under=(), limit=None):
+        ''' The shortest trajectory of the network of a solution from the
+        state source to the state target (names of the states of the
+        constrains file; their unset bits are free), with the KO/FE bits of
+        the states in under and of source (the others are 0).
+
+        Needs no build: the update functions are fixed by the solution, and
+        the horizon is deepened one step at a time, up to limit (default
+        self.step), on one solver with push/pop. Return the states of the
+        trajectory as a list of { specie: 0 or 1 }, or None. '''
+        boolean = self.backend == 'bool'
+        n = len(self.species)
+        if limit is None: limit = self.step
+        known = { 'KO': 0, 'FE': 0 }
+        for name in tuple(under) + (source,):
+            for v, i, b in self.bits[name]:
+                if v != 'Q' and b: known[v] |= 1 << i
+        ko, fe = [ makeConst(known[v], len(self.kofe[v]) or 1, boolean)
+                   for v in ('KO', 'FE') ]
+        fs = []
+        chosen = solution.A, solution.R
+        for c, s in enumerate(self.species):
+            acts, reps = self.inters[c]
+            A, R = [ makeConst(
+                         sum(1 << len(ilist) - 1 - i for i, j in
+                             enumerate(ilist) if self.species[j] in names[s]),
+                         len(ilist), boolean) if ilist else None
+                     for ilist, names in zip((acts, reps), chosen) ]
+            kofe_index = (s in self.koIndex and self.koIndex[s] + 1,
+                          s in self.feIndex and self.feIndex[s] + 1)
+            fs.append(makeFunction(acts, reps, kofe_index, solution.L[s], A, R))
+        state = lambda q, name: And([ bitOf(q, c) == b for v, c, b in
+                                      self.bits[name] if v == 'Q' ])
+        solver = Solver()
+        qs = [ self.vector('Reach_0', n) ]
+        solver.add(state(qs[0], source))
+        for t in range(limit + 1):
+            solver.push()
+            solver.add(state(qs[t], target))
+            if solver.check() == sat:
+                m = solver.model()
+                return [ dict((s, int(is_true(m.eval(bitOf(q, c), True))))
+                              for c, s in enumerate(self.species))
+                         for q in qs ]
+            solver.pop()
+            qs.append(self.vector('Reach_%d'%(t + 1), n))
+            solver.add([ bitOf(qs[t+1], c) == f(qs[t], ko, fe)
+                         for c, f in enumerate(fs) ])
+        return None
+
+def _enumerate(abn, ilimit, semantic, bounds, tasks, results):
+    ''' Worker of ABN.psolve: build the model, then enumerate the solutions
+    inside every cube pulled from tasks. '''
+    abn.build(ilimit, detail=False)
+    abn.bound(*bounds)
+    base = abn.solver.assertions()
+    for cube in iter(tasks.get, None):
+        # a fresh solver for every cube, so that the cube and the blocking
+        # clauses of its solutions are left behind with it; solve() may
+        # replace the solver anyway, when it compacts the blocking clauses
+        abn.solver = abn.makeSolver()
+        abn.solver.add(base)
+        abn.solver.add([ abn.literal(lit) for lit in cube ])
+        for s in abn.solve(semantic=semantic):
+            results.put((s.packed, s.logic, s.function))
+    results.put(None)
+
+def _race(abn, i, config, exps, results):
+    ''' Worker of ABN.race: check the model with the i-th configuration. '''
+    strategy, params = config
+    start = time()
+    try:
+        solver = abn.makeSolver(strategy, **params)
+        solver.add(abn.solver.assertions())
+        result = str(solver.check(abn.assumptions(exps)))
+    except Exception:
+        result = 'error'
+    results.put((i, result, time() - start))
+
+class Solution(object):
+    ''' A printable solution object. Only the selected logics and the
+    Act_/Rep_ assignment, packed into one int (see packOf), are kept; the
+    A/R/L dicts and the bits are made from them when asked for. '''
+    __slots__ = ('species', 'inters', 'packed', 'logic', 'function')
+
+    def __init__(self, species, inters, packed, logic, function=None):
+        self.species = species # shared with the ABN, as inters
+        self.inters = inters
+        self.packed = packed
+        self.logic = logic # in the order of species
+        self.function = function # truth tables, from a semantic solve()
+
+    @property
+    def bits(self):
+        ''' The raw Act_/Rep_ assignment: { vector name: bits, MSB first }. '''
+        layout = [ (prefix + s, len(ilist)) for c, s in enumerate(self.species)
+                   for prefix, ilist in zip(('Act_', 'Rep_'), self.inters[c])
+                   if ilist ]
+        total = sum(w for name, w in layout)
+        packed = bin(self.packed)[2:].zfill(total)
+        bits = {}
+        for name, w in layout:
+            bits[name], packed = packed[:w], packed[w:]
+        return bits
+
+    def selected(self, k):
+        ''' The selected activators (k = 0) or repressors (k = 1) of every
+        specie, as { specie: [names] }. '''
+        bits = self.bits
+        prefix = ('Act_', 'Rep_')[k]
+        return dict((s, [ self.species[i] for i, b in
+                          zip(self.inters[c][k], bits.get(prefix + s, ''))
+                          if b == '1' ])
+                    for c, s in enumerate(self.species))
+
+    A = property(lambda self: self.selected(0))
+    R = property(lambda self: self.selected(1))
+    L = property(lambda self: dict(zip(self.species, self.logic)))
+
+    def output(self, config=True, model=False):
+        ''' Print the solution; the symbolic rules (model) are opt-in. '''
+        printModel(self.species, self.A, self.R, self.L, config, model)
         
         
     
@@ -0,0 +1,155 @@
+''' Notifications of the progress of long runs, sent in the background.
+
+A Notifier takes events (build finished, every some solutions, the final
+summary) from the solving loop into a queue per sink, and a thread per sink
+delivers them, retrying the final summary if it fails; so the loop never
+waits on I/O, and no sink waits on another. The sinks are a file (one JSON
+line per event), a Unix socket (the same lines) and a mail over SMTP (the
+summary only, by default).
+'''
+from threading import Thread
+from Queue import Queue
+from time import time, sleep, localtime, strftime
+from smtplib import SMTP, SMTPAuthenticationError
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import json, socket
+
+EVENTS = ('build', 'progress', 'finished')
+
+class FileSink(object):
+    ''' Append every event to a file, as a JSON line. '''
+    events = EVENTS
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self): return self.path
+
+    def deliver(self, event):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event, sort_keys=True) + '\n')
+
+class SocketSink(object):
+    ''' Send every event as a JSON line to the Unix socket at path, on a
+    connection of its own. '''
+    events = EVENTS
+
+    def __init__(self, path, timeout=10):
+        self.path, self.timeout = path, timeout
+
+    def __str__(self): return 'unix:' + self.path
+
+    def deliver(self, event):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        try:
+            s.connect(self.path)
+            s.sendall(json.dumps(event, sort_keys=True) + '\n')
+        finally:
+            s.close()
+
+class MailSink(object):
+    ''' Mail the events to addr, through the SMTP server at host:port (a
+    local one, such as `python -m smtpd -n -c DebuggingServer`, by default),
+    logging in with pw if given. '''
+    events = ('finished', )
+
+    def __init__(self, addr, pw=None, host='localhost', port=25, timeout=30):
+        self.addr, self.pw = addr, pw
+        self.host, self.port, self.timeout = host, port, timeout
+
+    def __str__(self):
+        return 'smtp:%s@%s:%d'%(self.addr, self.host, self.port)
+
+    def deliver(self, event):
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = "Computation %s for '%s'." \
+            %(event['event'], event['problem'])
+        msg['From'] = msg['To'] = self.addr
+        msg.attach(MIMEText(formatEvent(event), 'plain'))
+        server = SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.pw:
+                try: server.login(self.addr, self.pw)
+                except SMTPAuthenticationError:
+                    raise IOError('login fail with %s'%self.addr)
+            server.sendmail(self.addr, [self.addr], msg.as_string())
+        finally:
+            server.close()
+
+def formatEvent(event):
+    ''' The fields of an event, one per line. '''
+    return ''.join([ '%s:\t%s\n'%(k, event[k]) for k in sorted(event) ])
+
+def sinkOf(spec):
+    ''' The sink of a spec: unix:PATH, smtp:ADDR@HOST[:PORT] (ADDR may have
+    an @ itself), or the path of a file. '''
+    kind, _, rest = spec.partition(':')
+    if kind == 'unix': return SocketSink(rest)
+    if kind == 'smtp':
+        addr, _, server = rest.rpartition('@')
+        host, _, port = server.partition(':')
+        return MailSink(addr, host=host, port=int(port or 25))
+    return FileSink(spec)
+
+class Notifier(object):
+    ''' Deliver events to the sinks, each from a queue and a background
+    thread of its own, so that a slow or dead sink holds up no other. A
+    failed delivery is given up; but the final summary, which must not be
+    lost, is tried again, retries times, after delay seconds (doubled every
+    time) first. The failures are reported by close(), in the main thread,
+    so that they do not cut into the output of the solving loop. '''
+
+    def __init__(self, sinks, problem, retries=3, delay=1.0):
+        self.sinks, self.problem = sinks, problem
+        self.retries, self.delay = retries, delay
+        self.queues, self.threads = [], []
+        self.failed = [] # (event, sink, error) of the failed deliveries
+        for sink in sinks:
+            queue = Queue()
+            thread = Thread(target=self.run, args=(sink, queue))
+            thread.daemon = True # never keep the process alive
+            thread.start()
+            self.queues.append(queue)
+            self.threads.append(thread)
+
+    def send(self, event, **fields):
+        ''' Queue an event (one of EVENTS) with its fields; never blocks. '''
+        fields.update(event=event, problem=self.problem,
+                      date=strftime('%d %b %H:%M:%S', localtime()))
+        for sink, queue in zip(self.sinks, self.queues):
+            if event in sink.events: queue.put(fields)
+
+    def run(self, sink, queue):
+        for event in iter(queue.get, None): self.deliver(sink, event)
+
+    def deliver(self, sink, event):
+        delay = self.delay
+        retries = event['event'] == 'finished' and self.retries or 0
+        for n in range(retries + 1):
+            try:
+                sink.deliver(event); return
+            except Exception as e:
+                error = e
+            if n < retries:
+                sleep(delay); delay *= 2
+        self.failed.append((event['event'], sink, error))
+
+    def close(self, timeout=60):
+        ''' Deliver the queued events, waiting at most timeout seconds in
+        all, then print the failed deliveries. '''
+        for queue in self.queues: queue.put(None)
+        deadline = time() + timeout
+        for thread in self.threads: thread.join(max(deadline - time(), 0))
+        for sink in self.sinks:
+            failed = [ (event, error) for event, s, error in self.failed
+                       if s is sink ]
+            if failed:
+                print '>> %d notifications to %s failed (%s): %s' \
+                    %(len(failed), sink, ', '.join(sorted(set(
+                        event for event, error in failed))), failed[-1][1])
+        for sink, thread in zip(self.sinks, self.threads):
+            if thread.is_alive():
+                print '>> Notifications to %s not done in %s sec.' \
+                    %(sink, timeout)
@@ -0,0 +1,132 @@
+''' A vectorized simulator of concrete networks, without z3.
+
+It gives a fast pre-filter for fixed networks, and an independent check on
+the solutions from ABN.solve() (and so on the rules in utility.py).
+'''
+import numpy as np
+from utility import STABLE
+
+# The 18 update rules over the conditions of utility.Preds, as bool arrays.
+RULES = {
+    0: lambda p: p.noR & p.anyA & p.allA,
+    1: lambda p: p.noR & p.someA,
+    2: lambda p: (p.noR & p.anyA & p.allA) | (p.anyR & p.noneR & p.someA),
+    3: lambda p: p.someA & p.noneR,
+    4: lambda p: p.anyA & p.allA & (p.noR | p.notAllR),
+    5: lambda p: (p.noR & p.someA) | (p.anyA & p.allA & p.notAllR),
+    6: lambda p: (p.noR & p.anyA & p.allA) | (p.someA & p.notAllR),
+    7: lambda p: (p.noR & p.someA) | (p.someA & p.notAllR),
+    8: lambda p: p.anyA & p.allA,
+    9: lambda p: (p.noR & p.someA) | (p.anyR & p.anyA & p.allA),
+    10: lambda p: (p.anyA & p.allA) | (p.anyR & p.someA & p.noneR),
+    11: lambda p: (p.noR & p.anyA & p.someA) |
+                  (p.anyR & p.anyA & (p.allA | (p.someA & p.noneR))),
+    12: lambda p: (p.anyA & p.allA) | (p.someA & p.notAllR),
+    13: lambda p: (p.noR & p.anyA & p.someA) |
+                  (p.anyR & p.anyA & (p.allA | (p.someA & p.notAllR))),
+    14: lambda p: (p.noR & p.anyA & p.allA) | (p.anyR & p.someA),
+    15: lambda p: p.someA,
+    16: lambda p: p.noA & p.someR & p.notAllR,
+    17: lambda p: p.noA & p.anyR & p.noneR,
+    }
+
+class _Preds(object):
+    ''' The conditions of one specie, over a batch of states q. '''
+    def __init__(self, q, acts, reps):
+        n = len(q)
+        a, r = q[:, acts], q[:, reps]
+        self.anyA = np.repeat(bool(acts), n)
+        self.anyR = np.repeat(bool(reps), n)
+        self.noA, self.noR = ~self.anyA, ~self.anyR
+        self.allA, self.someA = a.all(1), a.any(1)
+        self.noneR, self.someR = ~r.any(1), r.any(1)
+        self.notAllR = ~r.all(1)
+
+def _free(k):
+    ''' All 2^k assignments of k free bits, as rows. '''
+    return (np.arange(2 ** k)[:, None] >> np.arange(k)) & 1 == 1
+
+class Simulator(object):
+    ''' Simulate every experiment of readExp() for a concrete network.
+
+    The unobserved initial bits and KO/FE bits of an experiment are free, so
+    all their assignments are simulated together, as rows of one batch;
+    experiments with more than limit free bits are not simulated.
+    '''
+    def __init__(self, species, kofe, exps, states, limit=16):
+        self.species = species
+        self.index = dict((s, c) for c, s in enumerate(species))
+        self.kos, self.fes = [ dict((s, i) for i, s in enumerate(kofe[k]))
+                               for k in ('KO', 'FE') ]
+        n, nk, nf = len(species), len(self.kos), len(self.fes)
+        self.names, self.skipped = [], []
+        qs, kos, fes, owner = [], [], [], []
+        obs = [] # (t, mask, value, stable) of every experiment
+        for name, exp in sorted(exps.items()):
+            length = max(t for t, conditions in exp) + 1
+            mask = np.zeros((length, n + nk + nf), bool)
+            value = np.zeros((length, n + nk + nf), bool)
+            stable = np.zeros(length, bool)
+            for t, conditions in exp:
+                for cond in conditions:
+                    if cond == STABLE:
+                        stable[t] = True; continue
+                    for s, v in states[cond]:
+                        if s[:3] == 'KO_': c = n + self.kos[s[3:]]
+                        elif s[:3] == 'FE_': c = n + nk + self.fes[s[3:]]
+                        else: c = self.index[s]
+                        mask[t, c], value[t, c] = True, v == 1
+            # KO/FE are fixed along the path, as the initial bits
+            mask[0, n:] = mask[:, n:].any(0)
+            value[0, n:] = value[:, n:].any(0)
+            free = np.flatnonzero(~mask[0])
+            if len(free) > limit:
+                self.skipped.append(name); continue
+            init = np.repeat(value[:1], 2 ** len(free), 0)
+            init[:, free] = _free(len(free))
+            qs.append(init[:, :n]); kos.append(init[:, n:n+nk])
+            fes.append(init[:, n+nk:]); owner.append(len(self.names))
+            self.names.append(name)
+            obs.append((mask[:, :n], value[:, :n], stable))
+        self.q0 = np.concatenate(qs) if qs else np.zeros((0, n), bool)
+        self.ko = np.concatenate(kos) if kos else np.zeros((0, nk), bool)
+        self.fe = np.concatenate(fes) if fes else np.zeros((0, nf), bool)
+        self.owner = np.concatenate([ np.repeat(i, len(q))
+                                      for i, q in zip(owner, qs) ] or [[]])
+        self.owner = self.owner.astype(int)
+        # observations gathered per row, padded to the longest experiment
+        self.length = max([ len(s) for m, v, s in obs ] or [0])
+        pad = lambda a: np.concatenate(
+            [a, np.zeros((self.length - len(a),) + a.shape[1:], bool)])
+        self.mask = np.array([ pad(m) for m, v, s in obs ])[self.owner]
+        self.value = np.array([ pad(v) for m, v, s in obs ])[self.owner]
+        self.stable = np.array([ pad(s) for m, v, s in obs ])[self.owner]
+
+    def step(self, q, A, R, L):
+        ''' The next states of a batch of states q. '''
+        new = np.zeros_like(q)
+        for c, s in enumerate(self.species):
+            acts = [ self.index[a] for a in A[s] ]
+            reps = [ self.index[r] for r in R[s] ]
+            if L[s] in RULES: new[:, c] = RULES[L[s]](_Preds(q, acts, reps))
+            if s in self.kos: new[:, c] &= ~self.ko[:, self.kos[s]]
+            if s in self.fes: new[:, c] |= self.fe[:, self.fes[s]]
+        return new
+
+    def check(self, A, R, L):
+        ''' Return {experiment: passed} for the network given by the A/R/L
+        dicts of a Solution. Skipped experiments are not included. '''
+        q, ok = self.q0, np.ones(len(self.q0), bool)
+        for t in range(self.length):
+            new = self.step(q, A, R, L)
+            ok &= ((q == self.value[:, t]) | ~self.mask[:, t]).all(1)
+            ok &= ~self.stable[:, t] | (new == q).all(1)
+            q = new
+        passed = np.zeros(len(self.names), bool)
+        np.logical_or.at(passed, self.owner, ok)
+        return dict(zip(self.names, passed))
+
+    def verify(self, solution):
+        ''' The experiments a Solution fails (none, if it is right). '''
+        result = self.check(solution.A, solution.R, solution.L)
+        return sorted(name for name, passed in result.items() if not passed)
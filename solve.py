@@ -1,20 +1,24 @@
-from molle import ABN
+from molle import ABN, STEP
 from utility import *
+from notify import Notifier, MailSink, sinkOf
 from time import time, localtime, strftime
-import sys
+import sys, os
 
 PREFIX = "examplefiles/"
+RACE = 600 # seconds for the strategies to answer with -R
 INPUT = { 'ABCD_test': ( "SimpleFourComponentModel.txt",
                          "CertainInteractionRequired.txt" ), # not true
           'ABCD_kofe': ( "four_modified.txt",
                          "four_constrainst.txt" ),
+          'ABCD_stable': ( "four_modified.txt",
+                           "four_stable.txt" ), # same as ABCD_kofe
           'logics_range_test': ( "four_logic_modified.txt",
                                 "four_constrainst.txt" ),   
           'ABCD_nosolution': ("SimpleFourComponentModel.txt",
                               "NoSolutionsPossible.txt" ),
           'minimal_test': ( "custom.txt", # established model%combination
                             "UltimateConstrains.txt" ),
-          "find_min_logic": ( "simplestmodel.txt", # establised inters
+          "find_min_logic": ( "SimplestModel.txt", # establised inters
                               "UltimateConstrains.txt" ),
           'find_min_inter': ( "simplestlogic.txt", # established logics
                               "UltimateConstrains.txt" ),
@@ -39,13 +43,77 @@ if __name__ == '__main__':
         slimit, ilimit = [int(i) for i in sys.argv[idx:idx+2] ]
     else:
         slimit, ilimit = 10, 0
+    if '-t' in sys.argv: # horizon of trajectories
+        step = int(sys.argv[sys.argv.index('-t') + 1])
+    else:
+        step = STEP
+    if '-e' in sys.argv: # encoding backend, 'bv' or 'bool'
+        backend = sys.argv[sys.argv.index('-e') + 1]
+    else:
+        backend = 'bv'
+    if '-S' in sys.argv: # solver strategy, see utility.STRATEGIES
+        strategy = sys.argv[sys.argv.index('-S') + 1]
+        try: tacticsOf(strategy)
+        except ValueError as e:
+            print '>> Bad strategy: %s. ending.'%e; quit()
+    else:
+        strategy = 'default'
+    race = '-R' in sys.argv # race the strategies of molle.PORTFOLIO first
     output = '-o' in sys.argv
+    rules = '-r' in sys.argv # print the symbolic rules with -o
+    if '-k' in sys.argv: # checkpoint file, resumed if it exists
+        checkpoint = Checkpoint(sys.argv[sys.argv.index('-k') + 1])
+    else:
+        checkpoint = None
+    if '-w' in sys.argv: # stream the solutions to a .jsonl or .csv file
+        wpath = sys.argv[sys.argv.index('-w') + 1]
+        # carried on, if resuming
+        mode = checkpoint and os.path.exists(checkpoint.path) and 'a' or 'w'
+        writer = SolutionWriter(open(wpath, mode),
+                                wpath.endswith('.csv') and 'csv' or 'jsonl')
+    else:
+        writer = None
+    if '-C' in sys.argv: # directory of cached builds
+        cache = sys.argv[sys.argv.index('-C') + 1]
+    else:
+        cache = None
+    if '-P' in sys.argv: # write the profile of build and solve as JSON
+        ppath = sys.argv[sys.argv.index('-P') + 1]
+    else:
+        ppath = None
+    if '-q' in sys.argv: # shortest path between two states of each solution
+        i = sys.argv.index('-q') + 1
+        query = sys.argv[i:i+2]
+    else:
+        query = None
+    if '-u' in sys.argv: # the state giving the KO/FE bits of the query
+        under = (sys.argv[sys.argv.index('-u') + 1],)
+    else:
+        under = ()
+    minimal = '-n' in sys.argv # find the minimal model first
+    counting = '-N' in sys.argv # count the networks instead of listing them
+    semantic = '-f' in sys.argv # one solution per distinct set of functions
+    simulate = '-s' in sys.argv # pre-filter and verify by simulation
+    minlogic = '-c' in sys.argv # also minimize the logic complexity
     debug = '-d' in sys.argv
     verbose = '-v' in sys.argv or debug
-    mail = '-m' in sys.argv
-    if mail:
+    # sinks of the notifications, repeatable: a file, unix:PATH or
+    # smtp:ADDR@HOST[:PORT], see notify.sinkOf
+    sinks = [ sinkOf(sys.argv[i + 1]) for i, a in enumerate(sys.argv)
+              if a == '-E' ]
+    if '-i' in sys.argv: # solutions between the progress notifications
+        every = int(sys.argv[sys.argv.index('-i') + 1])
+    else:
+        every = 100
+    if '-p' in sys.argv: # number of worker processes
+        nproc = int(sys.argv[sys.argv.index('-p') + 1])
+    else:
+        nproc = 0
+    if '-m' in sys.argv: # mail the summary
         i = sys.argv.index('-m') + 1
         addr, pw = sys.argv[i:i+2]
+        sinks.append(MailSink(addr, pw, 'smtp.qq.com'))
+    notifier = sinks and Notifier(sinks, problem) or None
 
     # start timing
     startt = time()
@@ -56,23 +124,127 @@ if __name__ == '__main__':
     # reading inputs
     modelFile = open(mpath, 'r')
     expFile = open(epath, 'r')
-    model = ABN(modelFile, expFile)
+    model = ABN(modelFile, expFile, step, backend, strategy)
     modelFile.close(); expFile.close()
+    resumed = []
+    if checkpoint:
+        resumed = checkpoint.load()
+        if any(isinstance(record, dict) == semantic for record in resumed):
+            print '>> %s is not a checkpoint of a %s solve. ending.' \
+                %(checkpoint.path, semantic and 'semantic (-f)' or 'plain')
+            quit()
+        model.resume(resumed)
+        print '>> Resuming after %d solutions from %s.' \
+            %(len(resumed), checkpoint.path)
+
+    # simulation: a fixed network needs no solver if it fails
+    rejected = False
+    if simulate:
+        from simulate import Simulator
+        sim = Simulator(model.species, model.kofe, model.exps, model.states)
+        if sim.skipped:
+            print '>> Not simulated (too many free bits): %s' \
+                %', '.join(sim.skipped)
+        network = model.network()
+        if network:
+            result = sim.check(*network)
+            failed = sorted(name for name in result if not result[name])
+            rejected = bool(failed)
+            print '>> Fixed network %s in simulation.%s' \
+                %(rejected and 'FAILS' or 'passes',
+                  rejected and ' (%s)'%', '.join(failed) or '')
 
     # build the model
-    model.build(ilimit=ilimit, detail=verbose, debug=debug)
-    print ">> All Constrains established. (takes %s)" %conv_time(time()-startt)
+    if rejected:
+        print ">> Building skipped."
+    elif nproc and not (minimal or counting):
+        print ">> Building delegated to %d worker processes." %nproc
+    else:
+        model.build(ilimit=ilimit, detail=verbose, debug=debug, cache=cache)
+        print ">> All Constrains established. (takes %s)" \
+            %conv_time(time()-startt)
+        if notifier: notifier.send('build', duration=conv_time(time()-startt))
+
+    # pick the fastest solver configuration
+    if race and model.built:
+        racet = time()
+        winner = model.race(timeout=RACE)
+        if winner:
+            strategy, params, result, secs = winner
+            print '>> Strategy %s%s won the race: %s in %.1f sec. (takes %s)' \
+                %(strategy, params and ' %s'%params or '', result, secs,
+                  conv_time(time() - racet))
+        else:
+            print '>> No strategy could answer; keeping %s.'%model.strategy
+
+    # minimal model
+    bounds = () # of the minimal models, see ABN.bound
+    if minimal and not rejected:
+        print '>> ' + '- '* 15 # seperator
+        print '>> Minimizing the %s...' \
+            %(minlogic and 'interactions and logics' or 'interactions')
+        minimt = time()
+        result = model.minimize(logic=minlogic)
+        if result:
+            n, c, solution = result
+            print '>> Minimal model: %d optional interactions, ' \
+                'logic complexity %d. (takes %s)' \
+                %(n, c, conv_time(time() - minimt))
+            if output: solution.output(model=rules)
+            bounds = (n, c if minlogic else None) # for the workers of psolve
+        else:
+            print '>> No model. (takes %s)' %conv_time(time() - minimt)
+
+    # count the networks
+    if counting and not rejected:
+        print '>> ' + '- '* 15 # seperator
+        countt = time()
+        number, low, high = model.count()
+        if low == high:
+            print '>> Networks: %d, exactly. (takes %s)' \
+                %(number, conv_time(time() - countt))
+        else:
+            print '>> Networks: about %d (%d to %d). (takes %s)' \
+                %(number, low, high, conv_time(time() - countt))
 
     # get solutions
     print '>> ' + '- '* 15 # seperator
     solvingt = lastt = time() # just for timing
     print '>> Start solving: %s'%strftime("%d %b %H:%M",localtime(solvingt))
     count = 0
-    for solution in model.solve():
+    if rejected or counting: solutions = []
+    elif nproc: solutions = model.psolve(nproc, ilimit, semantic=semantic,
+                                         bounds=bounds)
+    else: solutions = model.solve(semantic=semantic)
+    for solution in solutions:
+        if checkpoint:
+            checkpoint.write(semantic and list(solution.function)
+                             or solution.bits)
         count += 1
-        print ">> Solution %d: (takes %.1f min)"%(count,(time() - lastt)/60)
+        secs = time() - lastt
+        print ">> Solution %d: (takes %.1f min)"%(count, secs/60)
         lastt = time() # update time for lasted model
-        if output: solution.output()
+        if writer: writer.write(len(resumed) + count, solution, secs)
+        if simulate:
+            failed = sim.verify(solution)
+            if failed:
+                print ">> !! Solution %d FAILS in simulation: %s" \
+                    %(count, ', '.join(failed))
+        if output: solution.output(model=rules)
+        if notifier and count % every == 0:
+            notifier.send('progress', solutions=count,
+                          duration=conv_time(time() - solvingt))
+        if query:
+            path = model.reach(solution, *query, under=under)
+            if path is None:
+                print '>> %s not reached from %s in %d steps.' \
+                    %(query[1], query[0], step)
+            else:
+                print '>> %s reached from %s in %d steps:' \
+                    %(query[1], query[0], len(path) - 1)
+                for t, q in enumerate(path):
+                    print '>> \t%d: %s'%(t, ''.join(str(q[s]) for s in
+                                                    model.species))
         if count == slimit: break
     endt = time()
 
@@ -84,10 +256,14 @@ if __name__ == '__main__':
     print '>> Solving duration:\t%s'%conv_time(endt - solvingt)
     total = conv_time(endt - startt)
     print '>> Total duration:\t%s'%total
-    if mail:
-        mailMe(addr, pw,
-               'Solutions number:\t%d\nTotal duration:\t%s'%(count, total),
-               "Computation Fnishied for '%s'."%problem)
+    if ppath and model.built:
+        import json
+        json.dump(model.report(), open(ppath, 'w'), indent=2, sort_keys=True)
+        print '>> Profile written to %s.'%ppath
+    if notifier:
+        notifier.send('finished', solutions=count, total=total,
+                      solving=conv_time(endt - solvingt))
+        notifier.close()
     print '>> ' + '-' * 9 + ' Finished. ' + '-' * 9
 
 
@@ -1,5 +1,6 @@
 from z3 import *
 from operator import or_
+from collections import namedtuple, OrderedDict
 from pprint import pprint
 
 def _sorted_inters(inter_list, sp):
@@ -10,6 +11,7 @@ def _sorted_inters(inter_list, sp):
     {1: ( (2, 3), (5, 9) )} : species 1 is activated by 2 and 3, and repressed
     by 5 and 9.
     '''
+    index = dict((s, c) for c, s in enumerate(sp)) # not sp.index(), O(n)
     d = dict([(c, ([], [])) for c in range(len(sp))]) # initialization
     for i in inter_list:
         f, t = i[:2]
@@ -18,7 +20,7 @@ def _sorted_inters(inter_list, sp):
         else:
             print 'no +/- assigend to interactions %d'%(inter_list)
             raise(Error)
-        tcode, fcode = sp.index(t), sp.index(f)
+        tcode, fcode = index[t], index[f]
         d.setdefault(tcode, ([], []))[idx].append(fcode)
     return d
 
@@ -40,33 +42,27 @@ def readModel(f, opmt = True):
     # read the components line
     for c in f.readline().strip().split(','):
         # get the gene name and +- mark
-        if '(' in c : gene_ = c[:c.index('(')].strip()
-        else: gene_ = c.strip()
+        gene_, bracket, rules = c.partition('(')
+        gene_ = gene_.strip()
         gene = filter(lambda x: not x in '+-', gene_)
         mark = filter(lambda x: x in '+-', gene_)
         # add to kofe if the gene has mark
         if('+' in mark): kofe['FE'].append(gene)
         if('-' in mark): kofe['KO'].append(gene)
         # record the allowed logics; if no, set to range(18)
-        if '(' in c:
-            left, right = c.index('('), c.index(')')
-            rules = tuple( int(i) for i in c[left+1:right].split() )
+        if bracket:
+            rules = tuple( int(i) for i in rules.partition(')')[0].split() )
         else:
             rules = tuple(range(18))
         logics[gene] = rules
         species.append(gene)
 
     # read the interaction lines
-    total_opt = total_def = 0
-    for line in f.readlines():
-        l = line.strip().split()
+    for line in f:
+        l = line.split()
         if(not l): continue # skip empty line
-        if 'optional' in l:
-            opt_inters_list.append(tuple(l[:3]))
-            total_opt += 1
-        else:
-            def_inters_list.append(tuple(l[:3]))
-            total_def += 1
+        if 'optional' in l: opt_inters_list.append(tuple(l[:3]))
+        else: def_inters_list.append(tuple(l[:3]))
     defI = _sorted_inters(def_inters_list, species)
     optI = _sorted_inters(opt_inters_list, species)
 
@@ -80,45 +76,77 @@ def _addExp(d, name, time_point, state_names_list):
 def _addState(d, state_name, gene, value):
     d.setdefault(state_name, []).append( (gene, int(value)) )
 
-# kept from old version
+STABLE = 'stable' # pseudo state name: the state is a fixed point
+
 def readExp(f):
   '''
   Take the file for experiment constrains, return two dicts:
 
   exps:   the Experimental constrains for every experiment
   states: records the mapping of shortcut name to node states
+
+  A line 'under #Exp stable at T $State;' also requires the state at T to be
+  a fixed point; it is recorded as the condition STABLE.
   '''
   exps = dict()
   states = dict()
 
   shortcut = ''
-  for l in f.readlines():
-    l = l.strip();
+  for l in f:
+    # one scan for each of the comment and the ;
+    l = l.partition('"')[0].partition(';')[0].split()
     if(not l): continue; # skip empty line
 
-    try: l = l[:l.index('"')] # remove commment
-    except ValueError: None
-    try: l = l[:l.index(';')] # remove ;
-    except ValueError: None
-
     if(shortcut): # inside the braket { }
-      if(l[0] == '{'): continue # skip left bracket
-      elif(l[0] == '}'): shortcut = '' # exit the braket;
-      else:
-        (left, right) = l.split('=');
-        name = left.strip();
-        value = right.split()[0];
-        _addState(states, shortcut, name, value); # record configuration
-    l = l.split();
+      if(l[0][0] == '{'): continue # skip left bracket
+      elif(l[0][0] == '}'): shortcut = ''; continue # exit the braket;
+      elif(l[0] != "//"): # 'name = value [and]'
+        name, value = ' '.join(l).split('=')
+        _addState(states, shortcut, name.strip(), value.split()[0])
+        continue
     if(l[0] == "//"): continue # comment line
-    elif(l[0] == "under"): _addExp(exps, l[1], l[3], l[4:]) # recordexp
+    elif(l[0] == "under"):
+      if(l[2] == STABLE): _addExp(exps, l[1], l[4], [STABLE] + l[5:])
+      else: _addExp(exps, l[1], l[3], l[4:]) # recordexp
     elif(l[0] == "let"):
-     shortcut = l[1]; # ready to enter the braket
-     try: shortcut = shortcut[:shortcut.index(':')]
-     except ValueError: None
+      shortcut = l[1].partition(':')[0] # ready to enter the braket
 
   return (exps, states);
 
+# The parsed model and constrains, indexed: see readProblem
+Problem = namedtuple('Problem', [
+    'species', 'logics', 'kofe', 'defI', 'optI', # as readModel
+    'exps', 'states',                            # as readExp
+    'index',    # { specie: c }, its index in species
+    'koIndex',  # { specie: i }, its index in kofe['KO']
+    'feIndex',  # { specie: i }, its index in kofe['FE']
+    'bits',     # { state: [(vector, i, bool)] }, see compileStates
+    ])
+
+def compileStates(states, index, kos, fes):
+    ''' Resolve the names in every state of readExp once: a bit 'X = v' is
+    (vector, i, v == 1), where vector is 'Q' (a specie), 'KO' or 'FE' (for
+    KO_X and FE_X), and i the index of X in it. '''
+    bits = {}
+    for name, pairs in states.items():
+        bits[name] = []
+        for s, value in pairs:
+            if s[:3] == 'KO_': bit = ('KO', kos[s[3:]])
+            elif s[:3] == 'FE_': bit = ('FE', fes[s[3:]])
+            else: bit = ('Q', index[s])
+            bits[name].append(bit + (value == 1, ))
+    return bits
+
+def readProblem(mfile, efile):
+    ''' Parse the model and the constrains files, and index all the names
+    once; return a Problem. '''
+    species, logics, kofe, defI, optI = readModel(mfile)
+    exps, states = readExp(efile)
+    index, kos, fes = [ dict((s, c) for c, s in enumerate(l))
+                        for l in (species, kofe['KO'], kofe['FE']) ]
+    return Problem(species, logics, kofe, defI, optI, exps, states,
+                   index, kos, fes, compileStates(states, index, kos, fes))
+
 def compati(l, actn, repn):
     ''' Speed up the solving. 
     Not sure with the validicity when actn == 0 of such approach. '''
@@ -132,6 +160,42 @@ def compati(l, actn, repn):
     else:
         return l
 
+def ruleClasses(logics, defA, defR):
+    ''' Group the logics of a specie by the update rule they give.
+
+    defA/defR tell, for each candidate activator/repressor, if it is defined
+    (always selected) or optional. Two logics are in one class when their
+    rules agree for every selection of the optional regulators and every
+    state. Return a list of (class, constant), in the order of logics, where
+    class is the list of its logics and constant is the value of a rule that
+    never changes (True or False), or None.
+    '''
+    A = [ Bool('_a%d'%i) for i in range(len(defA)) ]
+    R = [ Bool('_r%d'%i) for i in range(len(defR)) ]
+    x = [ Bool('_x%d'%i) for i in range(len(defA)) ]
+    y = [ Bool('_y%d'%i) for i in range(len(defR)) ]
+    p = _bool_preds(x, y, A[::-1], R[::-1]) # _bool_preds reads them reversed
+    solver = Solver()
+    solver.add([ a for a, d in zip(A, defA) if d ])
+    solver.add([ r for r, d in zip(R, defR) if d ])
+    def valid(e):
+        solver.push(); solver.add(Not(e))
+        result = solver.check() == unsat
+        solver.pop()
+        return result
+    classes = [] # of (class, constant, rule)
+    for l in logics:
+        rule = _create_rule(l, p)
+        for members, constant, other in classes:
+            if valid(rule == other):
+                members.append(l); break
+        else:
+            if valid(Not(rule)): constant = False
+            elif valid(rule): constant = True
+            else: constant = None
+            classes.append(([l], constant, rule))
+    return [ (members, constant) for members, constant, rule in classes ]
+
 zero = BitVecVal(0, 1)
 
 def Any(bvs):
@@ -141,121 +205,265 @@ def _concat(bvs):
     if len(bvs) == 1: return bvs[0]
     else: return Concat(bvs)
     
-def _create_bit_rule(num, act_list, rep_list, A, R):
-    ''' Create the update rule that return bit-vector of length 1. '''
-    if num == -1: return BoolVal(False) # special case
-    
+# The conditions which the update rules are made of. "Selected" means the
+# interaction is chosen by A (or R); "on" means the regulator is 1 in q.
+Preds = namedtuple('Preds', [
+    'noA',      # no activator selected
+    'anyA',     # some activator selected
+    'allA',     # all selected activators on (true if none selected)
+    'someA',    # some selected activator on
+    'noR',      # no repressor selected
+    'anyR',     # some repressor selected
+    'noneR',    # no selected repressor on
+    'someR',    # some selected repressor on
+    'notAllR']) # some selected repressor off
+
+def _bit_preds(act_list, rep_list, A, R):
     # initialization
     if act_list: act = _concat(act_list)
     else: act = A = zero
     if rep_list: rep = _concat(rep_list)
     else: rep = R = zero
-    
+    return Preds(A == 0, A != 0, A & act == A, A & act != 0,
+                 R == 0, R != 0, rep & R == 0, rep & R != 0, rep & R != R)
+
+def _bool_preds(act_list, rep_list, A, R):
+    # A and R are lists of Bool indexed like bits: A[-1-i] selects act_list[i]
+    A = list(reversed(A or [])); R = list(reversed(R or []))
+    return Preds(Not(Or(A)), Or(A),
+                 And([ Implies(a, x) for a, x in zip(A, act_list) ]),
+                 Or([ And(a, x) for a, x in zip(A, act_list) ]),
+                 Not(Or(R)), Or(R),
+                 Not(Or([ And(r, y) for r, y in zip(R, rep_list) ])),
+                 Or([ And(r, y) for r, y in zip(R, rep_list) ]),
+                 Or([ And(r, Not(y)) for r, y in zip(R, rep_list) ]))
+
+def _create_bit_rule(num, act_list, rep_list, A, R):
+    ''' Create the update rule over bit-vectors of length 1. '''
+    return _create_rule(num, _bit_preds(act_list, rep_list, A, R))
+
+def _create_bool_rule(num, act_list, rep_list, A, R):
+    ''' Create the update rule over Bools (lists of Bools for A, R). '''
+    return _create_rule(num, _bool_preds(act_list, rep_list, A, R))
+
+def _create_rule(num, p):
+    ''' Create the update rule from the conditions p (see Preds). '''
+    if num == -1: return BoolVal(False) # special case
+
     # creating result
     if num == 0:
-        return And(R == 0, A != 0, A & act == A)
+        return And(p.noR, p.anyA, p.allA)
     elif num == 1:
-        return And(R == 0, A & act != 0)
-       #return And(R == 0, A != 0, A & act != 0)
+        return And(p.noR, p.someA)
+       #return And(p.noR, p.anyA, p.someA)
     elif num == 2:
-        return Or( And(R == 0, A != 0, A & act == A),
-                   And(R != 0, rep & R == 0, A & act != 0) )
-       #return Or( And(R == 0, A != 0, A & act == A),
-       #           And(R != 0, A != 0, rep & R == 0, A & act != 0) )
+        return Or( And(p.noR, p.anyA, p.allA),
+                   And(p.anyR, p.noneR, p.someA) )
+       #return Or( And(p.noR, p.anyA, p.allA),
+       #           And(p.anyR, p.anyA, p.noneR, p.someA) )
     elif num == 3:
-        return And(A & act != 0, rep & R == 0)
+        return And(p.someA, p.noneR)
     elif num == 4:
-        return And( A != 0, A & act == A,
-                   Or(R == 0, rep & R != R) )
-       #return Or( And(R == 0, A != 0, A & act == A),
-       #           And(A != 0, A & act == A, rep & R != R) )
-       #return Or( And(R == 0, A != 0, A & act == A),
-       #           And(R != 0, A != 0, A & act == A, rep & R != R) )
+        return And( p.anyA, p.allA,
+                   Or(p.noR, p.notAllR) )
+       #return Or( And(p.noR, p.anyA, p.allA),
+       #           And(p.anyA, p.allA, p.notAllR) )
+       #return Or( And(p.noR, p.anyA, p.allA),
+       #           And(p.anyR, p.anyA, p.allA, p.notAllR) )
     elif num == 5:
-        return Or( And(R == 0, act & A != 0),
-                   And(A != 0, act & A == A, rep & R != R) )
-       #return Or( And(R == 0, A != 0, act & A != 0),
-       #           And(R != 0, A != 0, act & A == A, rep & R != R) )
+        return Or( And(p.noR, p.someA),
+                   And(p.anyA, p.allA, p.notAllR) )
+       #return Or( And(p.noR, p.anyA, p.someA),
+       #           And(p.anyR, p.anyA, p.allA, p.notAllR) )
     elif num == 6:
-        return Or( And(R == 0, A != 0, act & A == A),
-                   And(act & A != 0, rep & R != R) )
-       #return Or( And(R == 0, A != 0, act & A == A),
-       #          And(R != 0, A != 0, act & A != 0, rep & R != R) )
+        return Or( And(p.noR, p.anyA, p.allA),
+                   And(p.someA, p.notAllR) )
+       #return Or( And(p.noR, p.anyA, p.allA),
+       #          And(p.anyR, p.anyA, p.someA, p.notAllR) )
     elif num == 7:
-        return Or( And(R == 0, act & A != 0),
-                   And(act & A != 0, rep & R != R) )
-       #return Or( And(R == 0, A != 0, act & A != 0),
-       #           And(R != 0, A != 0, act & A != 0, rep & R != R) )
+        return Or( And(p.noR, p.someA),
+                   And(p.someA, p.notAllR) )
+       #return Or( And(p.noR, p.anyA, p.someA),
+       #           And(p.anyR, p.anyA, p.someA, p.notAllR) )
     elif num == 8:
-        return And(A != 0, act & A == A)
-       #return Or( And(R == 0, A != 0, act & A == A),
-       #           And(R != 0, A != 0, act & A == A) )
+        return And(p.anyA, p.allA)
+       #return Or( And(p.noR, p.anyA, p.allA),
+       #           And(p.anyR, p.anyA, p.allA) )
     elif num == 9:
-        return Or( And(R == 0, act & A != 0),
-                   And(R != 0, A != 0, act & A == A) )
-       #return Or( And(R == 0, A != 0, act & A != 0),
-       #           And(R != 0, A != 0, act & A == A) )
+        return Or( And(p.noR, p.someA),
+                   And(p.anyR, p.anyA, p.allA) )
+       #return Or( And(p.noR, p.anyA, p.someA),
+       #           And(p.anyR, p.anyA, p.allA) )
     elif num == 10:
-        return Or( And(A != 0, act & A == A),
-                   And(R != 0, act & A != 0, rep & R == 0) )
-       #return Or( And(R == 0, A != 0, act & A == A),
-       #           And(R != 0, A != 0, Or(act & A == A,
-       #                                  And(act & A != 0, rep & R == 0))) )
+        return Or( And(p.anyA, p.allA),
+                   And(p.anyR, p.someA, p.noneR) )
+       #return Or( And(p.noR, p.anyA, p.allA),
+       #           And(p.anyR, p.anyA, Or(p.allA,
+       #                                  And(p.someA, p.noneR))) )
     elif num == 11:
-        return Or( And(R == 0, A != 0, act & A != 0),
-                   And(R != 0, A != 0, Or(act & A == A,
-                                          And(act & A != 0, rep & R == 0))) )
+        return Or( And(p.noR, p.anyA, p.someA),
+                   And(p.anyR, p.anyA, Or(p.allA,
+                                          And(p.someA, p.noneR))) )
     elif num == 12:
-        return Or( And(A != 0, act & A == A),
-                   And(act & A != 0, rep & R != R) )
-       #return Or( And(R == 0, A != 0, act & A == A),
-       #           And(R != 0, A != 0, Or(act & A == A,
-       #                                  And(act & A != 0, rep & R != R))) )
+        return Or( And(p.anyA, p.allA),
+                   And(p.someA, p.notAllR) )
+       #return Or( And(p.noR, p.anyA, p.allA),
+       #           And(p.anyR, p.anyA, Or(p.allA,
+       #                                  And(p.someA, p.notAllR))) )
     elif num == 13:
-        return Or( And(R == 0, A != 0, act & A != 0),
-                   And(R != 0, A != 0, Or(act & A == A,
-                                          And(act & A != 0, rep & R != R))) )
+        return Or( And(p.noR, p.anyA, p.someA),
+                   And(p.anyR, p.anyA, Or(p.allA,
+                                          And(p.someA, p.notAllR))) )
     elif num == 14:
-        return Or( And(R == 0, A != 0, act & A == A),
-                   And(R != 0, act & A != 0) )
-        #return Or( And(R == 0, A != 0, act & A == A),
-        #           And(R != 0, A != 0, act & A != 0) )
+        return Or( And(p.noR, p.anyA, p.allA),
+                   And(p.anyR, p.someA) )
+        #return Or( And(p.noR, p.anyA, p.allA),
+        #           And(p.anyR, p.anyA, p.someA) )
     elif num == 15:
-        return act & A != 0
-        #return Or( And(R == 0, A != 0, act & A != 0),
-        #           And(R != 0, A != 0, act & A != 0) )
+        return p.someA
+        #return Or( And(p.noR, p.anyA, p.someA),
+        #           And(p.anyR, p.anyA, p.someA) )
     elif num == 16:
-        return And(A == 0, rep & R != 0, rep & R != R)
-        #return And(A == 0, R != 0, rep & R != 0, rep & R != R)
+        return And(p.noA, p.someR, p.notAllR)
+        #return And(p.noA, p.anyR, p.someR, p.notAllR)
     elif num == 17:
-        return And(A == 0, R != 0, rep & R == 0)
+        return And(p.noA, p.anyR, p.noneR)
     else:
         print "Strange Num"
         raise ValueError
 
-def _with_kofe(kofe_idx, ko, fe, expr):
+def _with_kofe(kofe_idx, ko, fe, expr, known=(None, None)):
+    # known: the KO/FE bits fixed by the experiment, if any; the branch of
+    # a bit which is always 0 is left out
     koc, fec = kofe_idx
-    if koc:
-        ko = Extract(koc-1,koc-1,ko) == 1 # a trick to avoid 0 == False
-        if fec:
-            fe = Extract(fec-1,fec-1,fe) == 1
-            return Or(fe, And(Not(ko), expr))
-        else: return And(Not(ko), expr)
-    elif fec:
-        fe = Extract(fec-1,fec-1,fe) == 1
-        return Or(fe, expr)
-    else: return expr
+    kov, fev = known
+    if koc and kov is not False:
+        if kov: expr = BoolVal(False)
+        else: expr = And(Not(bitOf(ko, koc-1)), expr) # avoid 0 == False
+    if fec and fev is not False:
+        if fev: expr = BoolVal(True)
+        else: expr = Or(bitOf(fe, fec-1), expr)
+    return expr
+
+def _constant(b):
+    # the value of a Bool expr if it is a constant, or None
+    return True if is_true(b) else False if is_false(b) else None
+
+def makeVector(name, n, boolean=False):
+    ''' A BitVec of n bits, or a list of n Bools for the bool backend. '''
+    if boolean: return [ Bool('%s_%d'%(name, i)) for i in range(n) ]
+    return BitVec(name, n)
+
+def makeKnown(name, n, known, boolean=False):
+    ''' A vector as makeVector() would make, but with the bits in known
+    ({ index: bool }) fixed to constants, so that they fold into the terms
+    over it. '''
+    if boolean:
+        return [ BoolVal(known[i]) if i in known else Bool('%s_%d'%(name, i))
+                 for i in range(n) ]
+    v = BitVec(name, n)
+    if not known: return v
+    parts = [] # from the leftmost bit
+    for i in reversed(range(n)):
+        if i in known: parts.append(BitVecVal(int(known[i]), 1))
+        elif parts and isinstance(parts[-1], list): parts[-1][1] = i
+        else: parts.append([i, i]) # a new run of free bits
+    return _concat([ Extract(p[0], p[1], v) if isinstance(p, list) else p
+                     for p in parts ])
+
+# Solver configurations, by name: None for the plain Solver(), a z3 logic
+# for SolverFor(), or a tuple of tactics for Then(...).solver(). Tactic
+# solvers start from scratch at every check, and give no unsat cores.
+STRATEGIES = OrderedDict([
+    ('default', None),
+    ('qfbv', ('card2bv', 'qfbv')), # SolverFor('QF_BV') drops AtMost (z3 4.5)
+    ('bitblast', ('simplify', 'card2bv', 'bit-blast', 'sat')),
+    ('solve-eqs', ('simplify', 'solve-eqs', 'card2bv', 'bit-blast', 'sat')),
+    ])
+
+def tacticsOf(strategy):
+    ''' The tactics of the strategy, a name of STRATEGIES or z3 tactics
+    joined by commas (e.g. 'simplify,bit-blast,sat'); None for the default
+    solver. Raise ValueError for anything else. '''
+    if strategy in STRATEGIES: return STRATEGIES[strategy]
+    spec = tuple(strategy.split(','))
+    if len(spec) < 2:
+        raise ValueError("strategy %s is neither one of %s nor tactics "
+                         "joined by commas"%(strategy, ', '.join(STRATEGIES)))
+    unknown = [ t for t in spec if t not in tactics() ]
+    if unknown:
+        raise ValueError('unknown tactics %s'%', '.join(unknown))
+    return spec
+
+def makeSolver(strategy='default', **params):
+    ''' A solver of the strategy (see tacticsOf), with the params set. '''
+    spec = tacticsOf(strategy)
+    if spec is None: solver = Solver()
+    else: solver = Then(*spec).solver()
+    if params: solver.set(**params)
+    return solver
+
+def makeConst(value, n, boolean=False):
+    ''' A constant vector of n bits, as makeVector() would make. '''
+    if boolean: return [ BoolVal(bool(value >> i & 1)) for i in range(n) ]
+    return BitVecVal(value, n)
+
+def bitOf(v, i):
+    ''' The i-th bit of a vector from makeVector(), as a Bool expr. '''
+    if isinstance(v, list): return v[i]
+    return Extract(i, i, v) == 1
+
+def widthOf(v):
+    if isinstance(v, list): return len(v)
+    return v.size()
+
+def partsOf(v):
+    ''' The z3 terms making up a vector (the BitVec itself, or its Bools). '''
+    if isinstance(v, list): return v
+    return [v]
 
 def makeFunction(acts, reps, kofe_index, logic, A, R):
-    ''' Makes a function that takes q, A, R, and return a coresponding z3 expr.
-    A is the acticators-selecting bit-vector, R for repressors.
+    ''' Makes a function that takes q, ko, fe, and return a coresponding z3
+    expr. A is the acticators-selecting vector, R for repressors; vectors
+    are either BitVecs or lists of Bools (see makeVector).
+
+    The rule is built and simplified only once over symbolic q, ko and fe
+    (for each size of them, and each value of the Bool KO/FE bits when they
+    are fixed, see makeKnown), then instantiated by substitute().
     '''
-    return lambda q, ko, fe: simplify(
-        _with_kofe(kofe_index, ko, fe,
-                   _create_bit_rule(logic,
-                                    [Extract(i,i,q) for i in acts],
-                                    [Extract(i,i,q) for i in reps],
-                                    A, R)))
+    templates = {}
+    used = sorted(set(acts) | set(reps))
+    last = [None, None, None] # (ko, fe, known) of the last experiment
+    def parts(q, ko, fe):
+        # only the terms the rule depends on, to keep substitute() cheap
+        if not isinstance(q, list): return [q, ko, fe]
+        koc, fec = kofe_index
+        return [ q[i] for i in used ] + ko[koc-1:koc] + fe[fec-1:fec]
+    def f(q, ko, fe):
+        boolean = isinstance(q, list)
+        koc, fec = kofe_index
+        if boolean and (last[0] is not ko or last[1] is not fe):
+            last[:] = [ko, fe, (koc and _constant(ko[koc-1]),
+                                fec and _constant(fe[fec-1]))]
+        # over BitVecs, z3 folds the fixed KO/FE bits better by itself
+        known = last[2] if boolean else (None, None)
+        key = (widthOf(q), widthOf(ko), widthOf(fe), boolean, known)
+        if key not in templates:
+            q_, ko_, fe_ = [ makeVector('_' + n, size, boolean) for n, size in
+                             zip(('q', 'ko', 'fe'), key) ]
+            if boolean:
+                rule = _create_bool_rule(logic, [q_[i] for i in acts],
+                                         [q_[i] for i in reps], A, R)
+            else:
+                rule = _create_bit_rule(logic,
+                                        [Extract(i,i,q_) for i in acts],
+                                        [Extract(i,i,q_) for i in reps],
+                                        A, R)
+            rule = simplify(_with_kofe(kofe_index, ko_, fe_, rule, known))
+            templates[key] = (parts(q_, ko_, fe_), rule)
+        vs, rule = templates[key]
+        return substitute(rule, *zip(vs, parts(q, ko, fe)))
+    return f
 
 def isExpOf2(bvv):
     return len(filter(lambda x: x == '1', bin(bvv.as_long()))) == 1
@@ -308,31 +516,79 @@ def _create_sym_rule(num, act, rep):
         else: return boolf
     else: return boolf # no act no rep
 
-def checkBit(i, bv):
-    # simplify is necessary
-    return simplify(Extract(i, i, bv)).as_long() == 1
-
 def bv2logic(lbvv, llist):
     ''' convert a bit-vector to a integer, as logic function number.'''
     assert isExpOf2(lbvv)
     lcode = len(bin(lbvv.as_long()).lstrip('0b')) - 1
     return llist[lcode]
 
-def bv2inters(ibvv, ilist, species):
-    if is_true(simplify(ibvv == 0)): return []
-    assert is_false(simplify(ibvv == 0))
-    l = ibvv.size() - 1
-    return [species[c] for i, c in enumerate(ilist) if checkBit(l-i, ibvv)]
-
-def getDetail(m, A_, R_, L_, species, inters, logics):
-    A = {}; R = {}; L = {}
-    for c, s in enumerate(species):
-        L[s] = bv2logic(m[L_[s]], logics[s])
-        if A_[s]: A[s] = bv2inters(m[A_[s]] or zero, inters[c][0], species)
-        else: A[s] = []
-        if R_[s]: R[s] = bv2inters(m[R_[s]] or zero, inters[c][1], species)
-        else: R[s] = []
-    return (A, R, L)
+def bools2logic(m, lbs, llist):
+    ''' convert a list of Bools to the selected logic function number.'''
+    on = [ i for i, b in enumerate(lbs) if is_true(m.eval(b, True)) ]
+    assert len(on) == 1
+    return llist[on[0]]
+
+def getLogics(m, L_, species, logics):
+    ''' The selected logics of model m, as a tuple in the order of species.'''
+    L = []
+    for s in species:
+        if isinstance(L_[s], list): # bool backend
+            L.append(bools2logic(m, L_[s], logics[s]))
+        else:
+            L.append(bv2logic(m[L_[s]], logics[s]))
+    return tuple(L)
+
+def packOf(m, vectors):
+    ''' The values of the vectors (see makeVector) in model m, packed into
+    one int, the first vector leftmost. '''
+    packed = 0
+    for v in vectors:
+        if isinstance(v, list):
+            value = sum([ 1 << i for i, b in enumerate(v)
+                          if is_true(m.eval(b, True)) ])
+        else:
+            value = m.eval(v, True).as_long()
+        packed = packed << widthOf(v) | value
+    return packed
+
+def mergeCubes(cubes):
+    ''' Merge the pairs of cubes, as (mask, value) ints, which differ in just
+    one bit of the same mask, until there is none; the merged cubes cover the
+    same assignments (if the cubes are disjoint, so are they). '''
+    while True:
+        masks = {}
+        for mask, value in cubes: masks.setdefault(mask, set()).add(value)
+        merged = []
+        for mask, values in masks.items():
+            bits = [ 1 << i for i in range(mask.bit_length()) if mask >> i & 1 ]
+            for value in sorted(values):
+                if value not in values: continue # merged already
+                values.discard(value)
+                for b in bits:
+                    if value ^ b in values:
+                        values.discard(value ^ b)
+                        merged.append((mask & ~b, value & ~b))
+                        break
+                else:
+                    merged.append((mask, value))
+        if len(merged) == len(cubes): return merged
+        cubes = merged
+
+RULES = 4096 # the number of rendered rules kept by renderRule
+
+_rendered = OrderedDict() # (logic, acts, reps): rule, the least recent first
+
+def renderRule(logic, acts, reps):
+    ''' The simplified symbolic rule of a logic over the names of activators
+    and repressors, as a string. The last RULES rules used are cached. '''
+    key = (logic, tuple(acts), tuple(reps))
+    if key in _rendered:
+        rule = _rendered.pop(key)
+    else:
+        rule = str(simplify(_create_sym_rule(logic, acts, reps)))
+        if len(_rendered) >= RULES: _rendered.popitem(last=False)
+    _rendered[key] = rule
+    return rule
 
 def printModel(species, A, R, L, config = True, model = True):
     ''' Print the solved model nicely. '''
@@ -347,22 +603,108 @@ def printModel(species, A, R, L, config = True, model = True):
     if model:
         print ">>\tModel: "
         for s in species: print ">>\t\t%s' = %s" \
-            %(s,simplify( _create_sym_rule(L[s], A[s], R[s]) ))
-
-from smtplib import SMTP, SMTPAuthenticationError
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-
-def mailMe(addr, pw, content, title = 'Computation Finished'):
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = title
-    msg['From'] = msg['To'] = addr
-    msg.attach(MIMEText(content, 'plain'))
-
-    server = SMTP('smtp.qq.com')
-    try:
-        server.login(addr, pw)
-        server.sendmail(addr, addr, msg.as_string())
-        server.quit()
-    except SMTPAuthenticationError:
-        print ">> SMTP: login fail with %s:%s"%(addr, pw)
+            %(s, renderRule(L[s], A[s], R[s]))
+
+import json, csv, os
+
+class SolutionWriter(object):
+    ''' Stream solutions to a file as they come, flushed one by one, so that
+    long runs can be tailed. fmt is 'jsonl' (one JSON object per solution)
+    or 'csv' (one row per specie of every solution).
+    '''
+    header = ('solution', 'time', 'species', 'logic',
+              'activators', 'repressors')
+
+    def __init__(self, f, fmt='jsonl'):
+        assert fmt in ('jsonl', 'csv')
+        self.f, self.fmt = f, fmt
+        if fmt == 'csv':
+            self.csv = csv.writer(f)
+            f.seek(0, 2)
+            if not f.tell(): self.csv.writerow(self.header) # not appending
+
+    def write(self, index, solution, secs):
+        ''' Write the index-th solution, which took secs to solve. '''
+        A, R, L = solution.A, solution.R, solution.L
+        if self.fmt == 'csv':
+            for s in solution.species:
+                self.csv.writerow((index, '%.3f'%secs, s, L[s],
+                                   ' '.join(A[s]), ' '.join(R[s])))
+        else:
+            self.f.write(json.dumps(OrderedDict([
+                ('solution', index), ('time', round(secs, 3)),
+                ('species', [ OrderedDict([ ('name', s), ('logic', L[s]),
+                                            ('activators', A[s]),
+                                            ('repressors', R[s]) ])
+                              for s in solution.species ]) ])) + '\n')
+        self.f.flush()
+
+class Checkpoint(object):
+    ''' Record the Act_/Rep_ assignment (see Solution.bits) of every solution,
+    or its truth tables in a semantic solve, as one JSON line, flushed at
+    once, so that a long enumeration can be resumed from it after a crash
+    (see ABN.resume).
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def load(self):
+        ''' The recorded assignments; a line cut by a crash is ignored. '''
+        if not os.path.exists(self.path): return []
+        assignments = []
+        for line in open(self.path):
+            try: assignments.append(json.loads(line))
+            except ValueError: pass
+        return assignments
+
+    def write(self, record):
+        if self.f is None:
+            self.f = open(self.path, 'a+')
+            self.f.seek(0, 2)
+            if self.f.tell():
+                self.f.seek(-1, 2)
+                if self.f.read(1) != '\n': self.f.write('\n') # cut line
+        self.f.write(json.dumps(record, sort_keys=True) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+from time import time
+
+def _conjuncts(e):
+    # the number of terms in the nested Ands of e
+    if is_and(e): return sum(_conjuncts(c) for c in e.children())
+    return 1
+
+class Profile(object):
+    ''' The wall time and the number of asserted terms of every phase of
+    ABN.build(), and the statistics of every check of ABN.solve(); see
+    ABN.report().
+    '''
+    STATS = ('conflicts', 'decisions', 'propagations', 'memory',
+             'max memory', 'rlimit count')
+
+    def __init__(self, solver):
+        self.solver = solver
+        self.phases = [] # of dicts: phase, time, terms (and more)
+        self.checks = [] # of dicts: time, result and the STATS
+        self.start, self.added, self.terms = time(), 0, 0
+
+    def phase(self, name, **more):
+        ''' Record the phase since the last one (or since start) as name.
+        Its terms are the conjuncts of the assertions it added. '''
+        assertions = self.solver.assertions()
+        terms = sum(_conjuncts(assertions[i]) for i in
+                    range(self.added, len(assertions)))
+        more.update(phase=name, time=time() - self.start, terms=terms)
+        self.phases.append(more)
+        self.start, self.added = time(), len(assertions)
+        self.terms += terms
+
+    def check(self, secs, result):
+        ''' Record the last check of the solver, which took secs. '''
+        stats = self.solver.statistics()
+        stats = dict(stats[i] for i in range(len(stats)))
+        record = dict((k, stats[k]) for k in self.STATS if k in stats)
+        record.update(time=secs, result=str(result))
+        self.checks.append(record)